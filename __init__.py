@@ -38,16 +38,30 @@ if "bpy" in locals():
     import imp
     if 'import_w4d' in locals():
         imp.reload(import_w4d)
+        imp.reload(reader_w4d)
+        imp.reload(mesh_w4d)
+        imp.reload(quantize_w4d)
         imp.reload(struct_w4d)
+        if 'batch_w4d' in locals():
+            imp.reload(pool_w4d)
+            imp.reload(batch_w4d)
 		
     if 'export_w4d' in locals():
         imp.reload(export_w4d)
+        imp.reload(writer_w4d)
+        imp.reload(bounds_w4d)
+        imp.reload(optimize_w4d)
+        imp.reload(quantize_w4d)
+        imp.reload(cache_w4d)
+        imp.reload(pool_w4d)
+        imp.reload(encode_w4d)
         imp.reload(struct_w4d)
 
+import os
 import time
 import datetime
 import bpy
-from bpy.props import StringProperty, BoolProperty, EnumProperty
+from bpy.props import StringProperty, BoolProperty, EnumProperty, IntProperty, CollectionProperty
 from bpy_extras.io_utils import ImportHelper, ExportHelper
 
 
@@ -59,12 +73,31 @@ class ImportW4D(bpy.types.Operator, ImportHelper):
 	
     filename_ext = '.w4d'
     filter_glob = StringProperty(default='*.w4d', options={'HIDDEN'})
+    files = CollectionProperty(type=bpy.types.OperatorFileListElement, options={'HIDDEN', 'SKIP_SAVE'})
+    directory = StringProperty(subtype='DIR_PATH', options={'HIDDEN', 'SKIP_SAVE'})
 	
     def execute(self, context):
         from . import import_w4d
-        print('Importing file', self.filepath)
+        paths = [os.path.join(self.directory, f.name) for f in self.files if f.name]
         t = time.mktime(datetime.datetime.now().timetuple())
-        with open(self.filepath, 'rb') as file:
+        if len(paths) > 1:
+            # parse all selected files in parallel, then build them one after another
+            from . import batch_w4d
+            print('Importing', len(paths), 'files')
+            results = batch_w4d.LoadFiles(paths, self = self)
+            try:
+                for parsed in results:
+                    print('Importing file', parsed.path)
+                    try:
+                        import_w4d.ImportParsedFile(parsed, context, self)
+                    finally:
+                        batch_w4d.ReleaseFile(parsed)
+            finally:
+                # the files after a failed one still hold their shared memory
+                for parsed in results:
+                    batch_w4d.ReleaseFile(parsed)
+        else:
+            print('Importing file', self.filepath)
             import_w4d.MainImport(self.filepath, context, self)
         t = time.mktime(datetime.datetime.now().timetuple()) - t
         print('Finished importing in', t, 'seconds')
@@ -87,6 +120,39 @@ class ExportW4D(bpy.types.Operator, ExportHelper):
 			('HAM', "HierarchicalAnimatedModel", "this will export the meshes with the hierarchy and animation into one file")
 			),			
 			default='M',)	
+
+    EXACT_SPHERE = BoolProperty(
+            name="Exact Bounding Spheres",
+            description="calculate the minimum bounding sphere of each mesh instead of a fast approximation",
+            default=False,)
+
+    OPTIMIZE_CACHE = BoolProperty(
+            name="Optimize Vertex Cache",
+            description="reorder the triangles and vertices of the meshes for the vertex cache (slower export)",
+            default=False,)
+
+    COMPACT_MESHES = BoolProperty(
+            name="Compact Meshes",
+            description="store positions, normals, uvs and faces quantized where the error stays below the tolerance",
+            default=True,)
+
+    ENCODE_POOL = EnumProperty(
+            name="Encode Meshes In",
+            items=(('THREAD', "Threads", "encode the meshes in a thread pool"), 
+			('PROCESS', "Processes", "encode the meshes in a process pool"), 
+			('NONE', "Sequence", "encode the meshes one after another")
+			),			
+			default='THREAD',)
+
+    ENCODE_WORKERS = IntProperty(
+            name="Workers",
+            description="number of threads or processes encoding the meshes (0 = one per cpu)",
+            default=0, min=0,)
+
+    INCREMENTAL = BoolProperty(
+            name="Reuse Unchanged Meshes",
+            description="keep the encoded meshes in a .cache folder next to the file and only encode the changed ones on the next export",
+            default=True,)
 		
     def execute(self, context):
         from . import export_w4d
@@ -0,0 +1,207 @@
+#Samples the time coded animation channels of the W4D Format (does not need blender)
+import bisect
+import numpy as np
+from . import quantize_w4d
+from .struct_w4d import Struct, TimeCodedAnimationChannel, Animation
+
+#######################################################################################
+# Interpolation
+#######################################################################################
+
+def Lerp(v0, v1, t):
+    return v0 + (v1 - v0) * t
+
+# normalized slerp of (N, 4) quaternion arrays, falls back to nlerp for nearly equal keys
+def Slerp(q0, q1, t):
+    q0 = np.asarray(q0, dtype = np.float64)
+    q1 = np.array(q1, dtype = np.float64)
+    t = np.asarray(t, dtype = np.float64)[..., np.newaxis]
+    dot = np.sum(q0 * q1, axis = -1, keepdims = True)
+    #take the short way
+    q1 = np.where(dot < 0.0, -q1, q1)
+    dot = np.clip(np.abs(dot), 0.0, 1.0)
+    theta = np.arccos(dot)
+    sinTheta = np.sin(theta)
+    near = sinTheta < 1e-6
+    sinTheta = np.where(near, 1.0, sinTheta)
+    w0 = np.where(near, 1.0 - t, np.sin((1.0 - t) * theta) / sinTheta)
+    w1 = np.where(near, t, np.sin(t * theta) / sinTheta)
+    result = w0 * q0 + w1 * q1
+    return result / np.linalg.norm(result, axis = -1, keepdims = True)
+
+def DefaultValue(vectorLen):
+    if vectorLen == 4:
+        return np.array((1.0, 0.0, 0.0, 0.0))
+    return 0.0
+
+#######################################################################################
+# Channel Sampler
+#######################################################################################
+
+# samples one TimeCodedAnimationChannel, remembers the last bracketing segment
+# so that sequential playback does not need to search
+class ChannelSampler:
+    def __init__(self, channel):
+        self.channel = channel
+        self.vectorLen = channel.vectorLen
+        self.frames = [int(f) for f in channel.frames]
+        self.values = np.asarray(channel.values, dtype = np.float64)
+        self.segment = 0
+
+    def FindSegment(self, frame):
+        frames = self.frames
+        seg = self.segment
+        if frames[seg] <= frame < frames[seg + 1]:
+            return seg
+        if seg + 2 < len(frames) and frames[seg + 1] <= frame < frames[seg + 2]:
+            return seg + 1
+        return min(max(bisect.bisect_right(frames, frame) - 1, 0), len(frames) - 2)
+
+    def Sample(self, frame):
+        count = len(self.frames)
+        if count == 0:
+            return DefaultValue(self.vectorLen)
+        if count == 1:
+            return self.values[0]
+        seg = self.FindSegment(frame)
+        self.segment = seg
+        f0 = self.frames[seg]
+        f1 = self.frames[seg + 1]
+        # keys on the same frame jump to the later value
+        t = min(max((frame - f0) / (f1 - f0), 0.0), 1.0) if f1 > f0 else 1.0
+        if self.vectorLen == 4:
+            return Slerp(self.values[seg], self.values[seg + 1], t)
+        return Lerp(self.values[seg], self.values[seg + 1], t)
+
+    def SampleFrames(self, frames):
+        return SampleChannels([self.channel], frames)[0]
+
+#######################################################################################
+# Animation Sampler
+#######################################################################################
+
+# samples all channels of a struct_w4d.Animation
+class AnimationSampler:
+    def __init__(self, animation):
+        self.animation = animation
+        self.channels = [ChannelSampler(channel) for channel in animation.channels]
+
+    def Sample(self, frame):
+        return [channel.Sample(frame) for channel in self.channels]
+
+    def SampleFrames(self, frames):
+        return SampleChannels(self.animation.channels, frames)
+
+# frames of different channels are shifted by this so one sorted array holds them all
+CHANNEL_STRIDE = 1 << 17
+
+# samples the channels at all the given frames, channels of the same vectorLen are
+# searched and interpolated together. returns one (F,) or (F, 4) array per channel
+def SampleChannels(channels, frames):
+    frames = np.clip(np.asarray(frames, dtype = np.float64).ravel(), 0, 0xFFFF)
+    results = [None] * len(channels)
+    for vectorLen in (1, 4):
+        group = [i for i, channel in enumerate(channels) if channel.vectorLen == vectorLen and len(channel.frames) > 0]
+        if len(group) == 0:
+            continue
+        counts = np.array([len(channels[i].frames) for i in group])
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        offsets = np.arange(len(group), dtype = np.float64) * CHANNEL_STRIDE
+        keys = np.concatenate([np.asarray(channels[i].frames, dtype = np.float64) + offsets[n] for n, i in enumerate(group)])
+        values = np.concatenate([np.asarray(channels[i].values, dtype = np.float64).reshape(-1, vectorLen) for i in group])
+
+        queries = frames[np.newaxis, :] + offsets[:, np.newaxis]
+        lo = np.searchsorted(keys, queries, side = "right") - 1
+        lo = np.clip(lo, starts[:, np.newaxis], (starts + np.maximum(counts - 2, 0))[:, np.newaxis])
+        hi = np.minimum(lo + 1, (starts + counts - 1)[:, np.newaxis])
+        span = keys[hi] - keys[lo]
+        t = np.where(span > 0, np.clip((queries - keys[lo]) / np.where(span > 0, span, 1.0), 0.0, 1.0), 1.0)
+
+        v0 = values[lo.ravel()]
+        v1 = values[hi.ravel()]
+        if vectorLen == 4:
+            sampled = Slerp(v0, v1, t.ravel())
+        else:
+            sampled = Lerp(v0, v1, t.ravel()[:, np.newaxis])
+        sampled = sampled.reshape(len(group), len(frames), vectorLen)
+        for n, i in enumerate(group):
+            results[i] = sampled[n] if vectorLen == 4 else sampled[n, :, 0]
+
+    for i, channel in enumerate(channels):
+        if results[i] is None:
+            results[i] = np.tile(DefaultValue(channel.vectorLen), (len(frames), 1)) if channel.vectorLen == 4 else np.zeros(len(frames))
+    return results
+
+#######################################################################################
+# Key Reduction
+#######################################################################################
+
+# how far the sampled channels may move away from the exported keys
+class AnimationTolerance(Struct):
+    value = 0.001 # position (vectorLen 1)
+    angle = 0.001 # radians (quaternions)
+
+# error of the values against the sampled ones, angular for quaternions
+def KeyErrors(values, sampled, vectorLen):
+    if vectorLen == 4:
+        dot = np.abs(np.sum(values * sampled, axis = -1))
+        return 2.0 * np.arccos(np.clip(dot, 0.0, 1.0))
+    return np.abs(values - sampled)
+
+# indices of the keys needed to reproduce all keys within the tolerance by interpolation.
+# the segment between two kept keys is split at its worst key until all of them fit
+def ReduceKeys(frames, values, vectorLen, tolerance):
+    count = len(frames)
+    if count < 3:
+        return np.arange(count)
+    frames = np.asarray(frames, dtype = np.float64)
+    keep = np.zeros(count, dtype = bool)
+    keep[0] = keep[-1] = True
+    segments = [(0, count - 1)]
+    while len(segments) > 0:
+        first, last = segments.pop()
+        if last - first < 2:
+            continue
+        inner = np.arange(first + 1, last)
+        t = (frames[inner] - frames[first]) / (frames[last] - frames[first])
+        if vectorLen == 4:
+            sampled = Slerp(np.broadcast_to(values[first], (len(inner), 4)), np.broadcast_to(values[last], (len(inner), 4)), t)
+        else:
+            sampled = Lerp(values[first], values[last], t)
+        errors = KeyErrors(values[inner], sampled, vectorLen)
+        worst = int(np.argmax(errors))
+        if errors[worst] > tolerance:
+            split = first + 1 + worst
+            keep[split] = True
+            segments.append((first, split))
+            segments.append((split, last))
+    return np.nonzero(keep)[0]
+
+# returns a channel with the keys that can not be interpolated from their neighbours,
+# channels that do not change at all keep only their first key
+# with packQuaternions the keys are reduced for a file written with packed quaternions,
+# the error of the packing is taken from the angle tolerance
+def ReduceChannel(channel, tolerance = None, packQuaternions = False):
+    if tolerance is None:
+        tolerance = AnimationTolerance()
+    vectorLen = channel.vectorLen
+    limit = tolerance.angle if vectorLen == 4 else tolerance.value
+    if vectorLen == 4 and packQuaternions:
+        limit = max(limit - quantize_w4d.PACKED_ANGLE_ERROR, 0.0)
+    frames = np.asarray(channel.frames, dtype = np.uint16)
+    values = np.asarray(channel.values, dtype = np.float64)
+    if vectorLen == 4:
+        values = values.reshape(-1, 4)
+        values = values / np.linalg.norm(values, axis = 1, keepdims = True)
+    if len(frames) == 0:
+        keep = np.arange(0)
+    elif np.all(KeyErrors(values, values[0], vectorLen) <= limit):
+        keep = np.arange(1)
+    else:
+        keep = ReduceKeys(frames, values, vectorLen, limit)
+    return TimeCodedAnimationChannel(vectorLen = vectorLen, type = channel.type, pivot = channel.pivot,
+        frames = frames[keep], values = values[keep].astype(np.float32))
+
+# pass the same packQuaternions as to writer_w4d.WriteAnimation
+def CompressAnimation(animation, tolerance = None, packQuaternions = False):
+    return Animation(header = animation.header, channels = [ReduceChannel(channel, tolerance, packQuaternions) for channel in animation.channels])
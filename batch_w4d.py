@@ -0,0 +1,152 @@
+#Parses many W4D Files at once in a process pool (does not need blender)
+import importlib
+import os
+import sys
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from . import struct_w4d, reader_w4d, pool_w4d
+
+#######################################################################################
+# Package
+#######################################################################################
+
+# name the parser modules are loaded under in the workers, importing the addon package
+# itself would run __init__.py which needs bpy
+PACKAGE = "w4d_batch"
+
+def LoadPackage():
+    directory = os.path.dirname(os.path.abspath(__file__))
+    exec(pool_w4d.BOOTSTRAP, {"name": PACKAGE, "directory": directory})
+    return importlib.import_module(PACKAGE + ".batch_w4d")
+
+#######################################################################################
+# Shared Arrays
+#######################################################################################
+
+# mesh arrays that are passed through shared memory instead of being pickled
+MeshArrays = ("verts", "normals", "faces", "uvCoords")
+
+# blocks created by this worker, they have to stay open until the parent attached them
+SharedBlocks = []
+
+def ShareMeshArrays(mesh):
+    arrays = [(name, np.ascontiguousarray(getattr(mesh, name))) for name in MeshArrays]
+    size = sum(array.nbytes for name, array in arrays)
+    if size == 0:
+        return
+    block = shared_memory.SharedMemory(create = True, size = size)
+    SharedBlocks.append(block)
+    offset = 0
+    for name, array in arrays:
+        np.ndarray(array.shape, dtype = array.dtype, buffer = block.buf, offset = offset)[...] = array
+        setattr(mesh, name, struct_w4d.SharedArray(block = block.name, offset = offset, dtype = array.dtype.str, shape = array.shape))
+        offset += array.nbytes
+
+def AttachMeshArrays(mesh, blocks):
+    for name in MeshArrays:
+        value = getattr(mesh, name)
+        if isinstance(value, struct_w4d.SharedArray):
+            if not value.block in blocks:
+                blocks[value.block] = shared_memory.SharedMemory(name = value.block)
+            buffer = blocks[value.block].buf
+            setattr(mesh, name, np.ndarray(value.shape, dtype = np.dtype(value.dtype), buffer = buffer, offset = value.offset))
+
+#######################################################################################
+# Parse
+#######################################################################################
+
+# errors are not raised but stored in the result, so one broken file does not stop the batch
+def ParseFile(path, share = True):
+    result = struct_w4d.W4DFile(path = path, meshes = [], blocks = [])
+    shared = len(SharedBlocks)
+    try:
+        for chunkType, header, payload in reader_w4d.IterFile(path, decodeMeshes = True):
+            if chunkType == 0:
+                result.model = payload.Decode()
+            elif chunkType == 1:
+                mesh = payload.Decode()
+                if share:
+                    ShareMeshArrays(mesh)
+                else:
+                    # copy the arrays out of the mapped file, it is closed after the loop
+                    for name in MeshArrays:
+                        setattr(mesh, name, np.array(getattr(mesh, name)))
+                result.meshes.append(mesh)
+            elif chunkType == 256:
+                result.hierarchy = payload.Decode()
+            elif chunkType == 512:
+                result.animation = payload.Decode()
+            elif chunkType == 1024:
+                result.box = payload.Decode()
+            else:
+                print("!!!unknown chunktype in File: %s" % chunkType)
+    except Exception:
+        e = sys.exc_info()[1]
+        print("!!!could not read %s: %s" % (path, e))
+        # the blocks of the meshes read so far would never be attached
+        for block in SharedBlocks[shared:]:
+            block.close()
+            block.unlink()
+        del SharedBlocks[shared:]
+        return struct_w4d.W4DFile(path = path, meshes = [], blocks = [], error = str(e))
+    return result
+
+def AttachFile(result):
+    blocks = {}
+    for mesh in result.meshes:
+        AttachMeshArrays(mesh, blocks)
+    result.blocks = list(blocks.values())
+    return result
+
+# frees the shared memory of a result, its mesh arrays can not be used afterwards
+def ReleaseFile(result):
+    for mesh in result.meshes:
+        for name in MeshArrays:
+            setattr(mesh, name, None)
+    for block in result.blocks:
+        try:
+            block.close()
+        except BufferError:
+            # still referenced somewhere, the mapping is freed with the last array
+            pass
+        block.unlink()
+    result.blocks = []
+
+# parses the files in a process pool and returns a W4DFile for each of them (in the given order).
+# files that could not be read are reported and left out.
+# call ReleaseFile on each result once its meshes have been created
+def LoadFiles(paths, maxWorkers = None, self = None):
+    paths = list(paths)
+    if len(paths) < 2 or maxWorkers == 1:
+        results = [ParseFile(path, share = False) for path in paths]
+    else:
+        results = ParseFiles(paths, maxWorkers)
+    loaded = []
+    for result in results:
+        if result.error is not None:
+            if self is not None:
+                self.report({'ERROR'}, "could not read %s: %s" % (result.path, result.error))
+            continue
+        # skeleton files of the batch do not have to be parsed again for the skins referencing them
+        if result.hierarchy is not None and len(result.meshes) == 0:
+            reader_w4d.SkeletonCache.Put(result.path, result.hierarchy)
+        loaded.append(result)
+    return loaded
+
+# falls back to parsing the files one after another if the pool does not work
+def ParseFiles(paths, maxWorkers = None):
+    package = LoadPackage()
+    directory = os.path.dirname(os.path.abspath(__file__))
+    results = []
+    try:
+        with ProcessPoolExecutor(max_workers = maxWorkers, **pool_w4d.PoolArguments(PACKAGE, directory)) as executor:
+            # attach while the workers still hold the blocks open
+            for result in executor.map(package.ParseFile, paths):
+                results.append(package.AttachFile(result))
+    except Exception:
+        print("!!!process pool failed, parsing the files one after another: %s" % sys.exc_info()[1])
+        for result in results:
+            ReleaseFile(result)
+        return [ParseFile(path, share = False) for path in paths]
+    return results
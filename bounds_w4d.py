@@ -0,0 +1,117 @@
+#Calculates the bounding volumes of the W4D meshes (does not need blender)
+import random
+import numpy as np
+from .struct_w4d import Vector
+
+# points this close to the surface count as inside
+EPSILON = 1e-6
+
+#######################################################################################
+# Bounding Box
+#######################################################################################
+
+# verts is a (N, 3) array, returns the (min, max) corners
+def BoundingBox(verts):
+    verts = np.asarray(verts, dtype = np.float32).reshape(-1, 3)
+    if len(verts) == 0:
+        return np.zeros(3), np.zeros(3)
+    return verts.min(axis = 0).astype(np.float64), verts.max(axis = 0).astype(np.float64)
+
+#######################################################################################
+# Ritter Sphere
+#######################################################################################
+
+def FarthestPoint(verts, point):
+    dists = np.einsum("ij,ij->i", verts - point, verts - point)
+    i = int(np.argmax(dists))
+    return i, dists[i] ** 0.5
+
+# approximate bounding sphere, at most a few percent bigger than the minimum one.
+# the points outside of the first guess are added one pass at a time, farthest first
+def RitterSphere(verts):
+    verts = np.asarray(verts, dtype = np.float64).reshape(-1, 3)
+    if len(verts) == 0:
+        return np.zeros(3), 0.0
+    # get the point with the biggest distance to the first one and from that one again
+    y = verts[FarthestPoint(verts, verts[0])[0]]
+    z = verts[FarthestPoint(verts, y)[0]]
+    center = (y + z) / 2
+    radius = np.linalg.norm(z - y) / 2
+
+    # grow the sphere until no vertex is outside
+    while True:
+        i, dist = FarthestPoint(verts, center)
+        if dist <= radius * (1 + EPSILON) + EPSILON:
+            return center, radius
+        delta = (dist - radius) / 2
+        radius += delta
+        center = center + (verts[i] - center) / dist * delta
+
+#######################################################################################
+# Minimum Sphere
+#######################################################################################
+
+# smallest sphere with all the given (at most 4) points on its surface
+def CircumSphere(points):
+    if len(points) == 0:
+        return np.zeros(3), -1.0
+    p0 = points[0]
+    if len(points) == 1:
+        return p0.copy(), 0.0
+    rows = np.array(points[1:]) - p0
+    # center = p0 + rows.T * l with (rows * rows.T) * l = |rows|^2 / 2
+    l = np.linalg.lstsq(rows @ rows.T, np.einsum("ij,ij->i", rows, rows) / 2, rcond = None)[0]
+    center = p0 + rows.T @ l
+    return center, float(max(np.linalg.norm(np.array(points) - center, axis = 1)))
+
+def Contains(center, radius, point):
+    return np.linalg.norm(point - center) <= radius * (1 + EPSILON) + EPSILON
+
+# welzl's algorithm with the boundary points kept in a list instead of recursing
+# for every point. expected linear time for points in random order
+def WelzlSphere(points, boundary = ()):
+    center, radius = CircumSphere(list(boundary))
+    if len(boundary) == 4:
+        return center, radius
+    for i in range(len(points)):
+        if not Contains(center, radius, points[i]):
+            center, radius = WelzlSphere(points[:i], tuple(boundary) + (points[i],))
+    return center, radius
+
+# exact minimum enclosing sphere. welzl only runs on a small support set, the vertices
+# outside of its sphere are found vectorized and added until none is left
+def MinimumSphere(verts):
+    verts = np.asarray(verts, dtype = np.float64).reshape(-1, 3)
+    if len(verts) == 0:
+        return np.zeros(3), 0.0
+    support = [verts[i] for i in np.unique(np.concatenate((verts.argmin(axis = 0), verts.argmax(axis = 0))))]
+    # own seeded generator, the same mesh always gets the same sphere (and chunk cache key)
+    # and the global random state of blender is left alone
+    shuffle = random.Random(0).shuffle
+    while True:
+        shuffle(support)
+        center, radius = WelzlSphere(support)
+        dists = np.linalg.norm(verts - center, axis = 1)
+        outside = np.nonzero(dists > radius * (1 + EPSILON) + EPSILON)[0]
+        if len(outside) == 0:
+            return center, radius
+        # the farthest ones are the most likely to end up on the surface
+        for i in outside[np.argsort(dists[outside])[-4:]]:
+            support.append(verts[i])
+
+#######################################################################################
+# Mesh Bounds
+#######################################################################################
+
+# fills minCorner, maxCorner, sphCenter and sphRadius of the MeshHeader
+def CalculateMeshBounds(verts, header, exact = False):
+    minCorner, maxCorner = BoundingBox(verts)
+    if exact:
+        center, radius = MinimumSphere(verts)
+    else:
+        center, radius = RitterSphere(verts)
+    header.minCorner = Vector(minCorner.tolist())
+    header.maxCorner = Vector(maxCorner.tolist())
+    header.sphCenter = Vector(center.tolist())
+    header.sphRadius = float(radius)
+    return header
@@ -0,0 +1,98 @@
+#Keeps the encoded mesh chunks of the last export next to the exported file (does not need blender)
+import hashlib
+import os
+import numpy as np
+from .struct_w4d import Struct
+
+# change this whenever the encoding of the mesh chunks changes, old entries are not used anymore
+CACHE_VERSION = 1
+
+CACHE_EXTENSION = ".chunk"
+
+#######################################################################################
+# Hash
+#######################################################################################
+
+def HashValue(hash, value):
+    if isinstance(value, np.ndarray):
+        value = np.ascontiguousarray(value)
+        hash.update(("%s%s" % (value.dtype.str, value.shape)).encode())
+        hash.update(memoryview(value).cast("B"))
+    elif isinstance(value, Struct):
+        hash.update(type(value).__name__.encode())
+        for name, item in sorted(vars(value).items()):
+            hash.update(name.encode())
+            HashValue(hash, item)
+    elif isinstance(value, (list, tuple)):
+        hash.update(b"[%i" % len(value))
+        for item in value:
+            HashValue(hash, item)
+        hash.update(b"]")
+    else:
+        # numbers, strings and the mathutils types
+        hash.update(repr(value).encode())
+
+# identifies a mesh source together with the settings it is encoded with
+def MeshKey(source, settings):
+    hash = hashlib.blake2b(digest_size = 20)
+    hash.update(b"w4d mesh %i" % CACHE_VERSION)
+    HashValue(hash, source)
+    HashValue(hash, settings)
+    return hash.hexdigest()
+
+#######################################################################################
+# Chunk Cache
+#######################################################################################
+
+# one file per encoded mesh chunk, named by its key
+class ChunkCache:
+    def __init__(self, directory):
+        self.directory = directory
+        self.used = set()
+        self.hits = 0
+        self.misses = 0
+
+    # the folder used for the exported file
+    @staticmethod
+    def ForFile(filepath):
+        return ChunkCache(filepath + ".cache")
+
+    def Path(self, key):
+        return os.path.join(self.directory, key + CACHE_EXTENSION)
+
+    def Get(self, key):
+        self.used.add(key)
+        try:
+            with open(self.Path(key), "rb") as file:
+                data = file.read()
+        except OSError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return data
+
+    def Put(self, key, data):
+        self.used.add(key)
+        try:
+            os.makedirs(self.directory, exist_ok = True)
+            # written under another name first, an interrupted export must not leave half a chunk
+            temp = self.Path(key) + ".tmp"
+            with open(temp, "wb") as file:
+                file.write(data)
+            os.replace(temp, self.Path(key))
+        except OSError as e:
+            print("!!!could not write chunk cache: %s" % e)
+
+    # deletes the chunks not used since the cache was opened
+    def Prune(self):
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        for name in names:
+            key, extension = os.path.splitext(name)
+            if extension in (CACHE_EXTENSION, ".tmp") and not key in self.used:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
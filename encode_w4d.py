@@ -0,0 +1,81 @@
+#Encodes the meshes extracted by the exporter into W4D chunks, in parallel (does not need blender)
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from . import struct_w4d, writer_w4d, bounds_w4d, mesh_w4d, optimize_w4d, pool_w4d, cache_w4d
+from .struct_w4d import Struct
+
+#######################################################################################
+# Mesh Source
+#######################################################################################
+
+# everything the exporter takes from a blender mesh, plain arrays only
+class MeshSource(Struct):
+    header = None # MeshHeader with name, type and parentPivot set
+    co = None # float32 3*V
+    cornerVerts = None # int32 3*F, source vertex of each triangle corner
+    cornerNormals = None # float32 3*F x 3
+    cornerUVs = None # float32 3*F x 2 or None
+    vertInfs = [] # MeshVertexInfluences per source vertex (skins only)
+    materials = []
+
+class EncodeSettings(Struct):
+    exactSphere = False
+    optimizeCache = False
+    tolerance = None # quantize_w4d.MeshTolerance for the compact chunks
+
+#######################################################################################
+# Encode
+#######################################################################################
+
+# returns the bytes of the complete mesh chunk
+def EncodeMesh(source, settings):
+    Header = source.header
+    bounds_w4d.CalculateMeshBounds(source.co, Header, exact = settings.exactSphere)
+
+    indexed = mesh_w4d.IndexCorners(source.co, source.cornerVerts, source.cornerNormals, source.cornerUVs)
+    if settings.optimizeCache:
+        faces, vertOrder, before, after = optimize_w4d.OptimizeMesh(indexed.faces, len(indexed.verts))
+        print("%s ACMR: %.3f -> %.3f ATVR: %.3f -> %.3f" % (Header.meshName, before.acmr, after.acmr, before.atvr, after.atvr))
+        indexed = mesh_w4d.IndexedMesh(verts = indexed.verts[vertOrder], normals = indexed.normals[vertOrder],
+            uvCoords = indexed.uvCoords[vertOrder], faces = faces, vertMap = indexed.vertMap[vertOrder])
+
+    Mesh = struct_w4d.Mesh(header = Header, verts = indexed.verts, normals = indexed.normals,
+        uvCoords = indexed.uvCoords, faces = indexed.faces, materials = source.materials)
+    Mesh.vertInfs = [source.vertInfs[i] for i in indexed.vertMap.tolist()] if len(source.vertInfs) > 0 else []
+    Header.vertCount = len(indexed.verts)
+    Header.faceCount = len(indexed.faces)
+
+    file = io.BytesIO()
+    writer_w4d.WriteMesh(file, Mesh, settings.tolerance)
+    return file.getvalue()
+
+# encodes the meshes in a pool and returns their chunks in the order of the sources.
+# pool is 'THREAD', 'PROCESS' or anything else to encode them one after another.
+# with a cache_w4d.ChunkCache only the meshes that changed since the last export are encoded
+def EncodeMeshes(sources, settings, pool = 'THREAD', maxWorkers = None, cache = None):
+    if cache is None:
+        return EncodeSources(sources, settings, pool, maxWorkers)
+    # the sources are hashed before encoding, it fills in the header
+    keys = [cache_w4d.MeshKey(source, settings) for source in sources]
+    chunks = [cache.Get(key) for key in keys]
+    missing = [i for i, chunk in enumerate(chunks) if chunk is None]
+    print("reusing %i of %i meshes" % (len(sources) - len(missing), len(sources)))
+    for i, chunk in zip(missing, EncodeSources([sources[i] for i in missing], settings, pool, maxWorkers)):
+        cache.Put(keys[i], chunk)
+        chunks[i] = chunk
+    return chunks
+
+def EncodeSources(sources, settings, pool = 'THREAD', maxWorkers = None):
+    if maxWorkers is not None and maxWorkers <= 0:
+        maxWorkers = None
+    if len(sources) < 2 or maxWorkers == 1 or not pool in ('THREAD', 'PROCESS'):
+        return [EncodeMesh(source, settings) for source in sources]
+    if pool == 'THREAD':
+        with ThreadPoolExecutor(max_workers = maxWorkers) as executor:
+            return list(executor.map(EncodeMesh, sources, [settings] * len(sources)))
+    # the workers load the modules under the name of this package without running its __init__.py
+    # (it needs bpy), so the sources can be pickled as they are
+    directory = os.path.dirname(os.path.abspath(__file__))
+    with ProcessPoolExecutor(max_workers = maxWorkers, **pool_w4d.PoolArguments(__package__, directory)) as executor:
+        return list(executor.map(EncodeMesh, sources, [settings] * len(sources)))
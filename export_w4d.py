@@ -4,78 +4,19 @@
 import bpy
 import operator
 import struct
+import io
 import os
 import math
 import sys
 import bmesh
 from bpy.props import *
 from mathutils import Vector, Quaternion
-from . import struct_w4d, import_w4d
+import numpy as np
+from . import struct_w4d, writer_w4d, mesh_w4d, quantize_w4d, encode_w4d, cache_w4d
 
 #TODO 
 
 
-HEAD = 8 #4(long = chunktype) + 4 (long = chunksize)
-
-#######################################################################################
-# Basic Methods
-#######################################################################################
-
-def getStringSize(string):
-    return len(string) + 1 #binary 0
-
-def WriteString(file, string):
-    file.write(bytes(string, 'UTF-8'))
-	#write binary 0 to file
-    file.write(struct.pack('B', 0))
-		
-def WriteRGBA(file, rgba):
-    file.write(struct.pack("B", rgba.r))
-    file.write(struct.pack("B", rgba.g))
-    file.write(struct.pack("B", rgba.b))
-    file.write(struct.pack("B", rgba.a))
-	
-# only if the chunk has subchunks -> else: WriteLong(file, data)
-def MakeChunkSize(data):
-    return (data | 0x80000000)
-
-def WriteLong(file, num):
-    file.write(struct.pack("<L", num))
-
-def WriteSignedLong(file, num):
-    file.write(struct.pack("<l", num))	
-	
-def WriteShort(file, num):
-    file.write(struct.pack("<H", num))
-
-def WriteSignedShort(file, num):
-    file.write(struct.pack("<h", num))
-	
-def WriteLongArray(file, array):
-    for a in array:
-        WriteLong(file, a)
-
-def WriteFloat(file, num):
-    file.write(struct.pack("<f", num))
-	
-def WriteSignedByte(file, num):
-    file.write(struct.pack("<b", num))
-
-def WriteUnsignedByte(file, num):
-    file.write(struct.pack("<B", num))
-	
-def WriteVector(file, vec):
-    WriteFloat(file, vec[0])
-    WriteFloat(file, vec[1])
-    WriteFloat(file, vec[2])
-	
-def WriteQuaternion(file, quat):
-    #changes the order from wxyz to xyzw
-    WriteFloat(file, quat[1])
-    WriteFloat(file, quat[2])
-    WriteFloat(file, quat[3])
-    WriteFloat(file, quat[0])
-	
 #######################################################################################
 # Triangulate
 #######################################################################################	
@@ -89,349 +30,129 @@ def triangulate(mesh):
     bm.free()
 	
 #######################################################################################
-# Hierarchy
-#######################################################################################
-
-def getHeaderChunkSize(header):
-    return 16 + getStringSize(header.name)
-
-def WriteHierarchyHeader(file, header):
-    WriteLong(file, 257) #chunktype
-    WriteLong(file, getHeaderChunkSize(header)) #chunksize
-	
-    WriteString(file, header.name)
-    WriteLong(file, header.pivotCount)
-    WriteVector(file, header.centerPos)
-	
-def getPivotsChunkSize(pivots):
-    size = 0
-    for pivot in pivots:
-        size += 31 + getStringSize(pivot.name)
-    return size
-
-def WritePivots(file, pivots):
-    WriteLong(file, 258) #chunktype
-    WriteLong(file, getPivotsChunkSize(pivots)) #chunksize
-	
-    for pivot in pivots:
-        WriteString(file, pivot.name)
-        WriteSignedShort(file, pivot.parentID)
-        WriteUnsignedByte(file, pivot.isBone)
-        WriteVector(file, pivot.position)
-        WriteQuaternion(file, pivot.rotation)
-
-def WriteHierarchy(file, hierarchy):
-    print("\n### NEW HIERARCHY: ###")
-    WriteLong(file, 256) #chunktype
-    
-    size = HEAD + getHeaderChunkSize(hierarchy.header) + HEAD + getPivotsChunkSize(hierarchy.pivots) 
-
-    WriteLong(file, MakeChunkSize(size)) #chunksize
-	
-    WriteHierarchyHeader(file, hierarchy.header)
-    print("Header")
-    WritePivots(file, hierarchy.pivots)
-    print("Pivots")
-
-#######################################################################################
-# Animation
-#######################################################################################
-	
-def WriteAnimationHeader(file, size, header):
-    WriteLong(file, 513) #chunktype
-    WriteLong(file, size) #chunksize
-
-    WriteString(file, header.name)
-    WriteString(file, header.hieraName)
-    WriteLong(file, header.numFrames)
-    WriteLong(file, header.frameRate)
-
-def WriteTimeCodedAnimationChannel(file, channel):
-    WriteLong(file, 514) #chunktype
-    size = 6 + (len(channel.timeCodedKeys) * channel.vectorLen) * 4
-    WriteLong(file, size) #chunksize
-	
-    WriteShort(file, channel.vectorLen)
-    WriteShort(file, channel.type)
-    WriteShort(file, channel.pivot)
-
-    if channel.vectorLen == 1:
-        for f in channel.timeCodedKeys:
-            WriteFloat(file, f)
-    elif channel.vectorLen == 4:
-        for quat in channel.timeCodedKeys:
-            WriteQuaternion(file, quat)
-
-def WriteAnimation(file, animation):
-    print("\n### NEW ANIMATION: ###")
-    WriteLong(file, 512) #chunktype
-	
-    headerSize = len(header.name) + len(header.hieraName) + 8
-    channelsSize = 0
-    for channel in animation.channels:
-        channelsSize += HEAD + 6 + (len(channel.timeCodedKeys) * channel.vectorLen) * 4
-    size = HEAD + headerSize + channelsSize		
-	
-    WriteLong(file, MakeChunkSize(size)) #chunksize
-	
-    WriteAnimationHeader(file, headerSize, animation.header)
-    print("Header")
-    for channel in animation.channels:
-        WriteAnimationChannel(file, channel)
-        print("Channel")
-	
-#######################################################################################
-# Model
-#######################################################################################
-
-def getModelChunkSize(model):
-    return getStringSize(model.name) + getStringSize(model.hieraName)
-
-def WriteModel(file, model):
-    print("\n### NEW MODEL: ###")
-    WriteLong(file, 0) #chunktype
-    WriteLong(file, getModelChunkSize(model)) #chunksize	
-
-    print(model.name)
-    WriteString(file, model.name)
-    print(model.hieraName)
-    WriteString(file, model.hieraName)
-			
-#######################################################################################
-# Box
-#######################################################################################	
-
-def WriteBox(file, box):
-    print("\n### NEW BOX: ###")
-    WriteLong(file, 1024) #chunktype
-    WriteLong(file, 24) #chunksize
-	
-    WriteVector(file, box.center)
-    WriteVector(file, box.extend)
-	
-#######################################################################################
-# Vertices
-#######################################################################################
-
-def getMeshVerticesChunkSize(vertices):
-    size = len(vertices) * 12
-    return size
-
-def WriteMeshVerticesArray(file, vertices):
-    WriteLong(file, 3) #chunktype
-    WriteLong(file, getMeshVerticesChunkSize(vertices)) #chunksize
-	
-    for vert in vertices:
-        WriteVector(file, vert)
-
-#######################################################################################
-# Normals
-#######################################################################################
-
-def getMeshNormalsArrayChunkSize(normals):
-    size = len(normals) * 12
-    return size
-	
-def WriteMeshNormalsArray(file, normals):
-    WriteLong(file, 4) #chunktype
-    WriteLong(file, getMeshNormalsArrayChunkSize(normals)) #chunksize
-	
-    for norm in normals:
-        WriteVector(file, norm)
-	
-#######################################################################################
-# Faces
-#######################################################################################	
-
-def getMeshFaceArrayChunkSize(faces):
-    size = len(faces) * 12
-    return size
-
-def WriteMeshFaceArray(file, faces):
-    WriteLong(file, 5) #chunktype
-    WriteLong(file, getMeshFaceArrayChunkSize(faces)) #chunksize
-	
-    for face in faces:
-        WriteLong(file, face[0])
-        WriteLong(file, face[1])
-        WriteLong(file, face[2])
-		
-#######################################################################################
-# uvCoords
+# Extract Mesh
 #######################################################################################	
 
-def getMeshUVCoordsChunkSize(uvCoords):
-    return len(uvCoords) * 8
-
-def WriteMeshUVCoords(file, uvCoords):
-    WriteLong(file, 6) #chunktype
-    WriteLong(file, MakeChunkSize(getMeshUVCoordsChunkSize(uvCoords))) #chunksize
+# takes everything the encoder needs from the mesh object, the pivot of a rigid mesh is added to the hierarchy
+def extractMesh(mesh_ob, Hierarchy, context):
+    Header = struct_w4d.MeshHeader()
+
+    Header.meshName = mesh_ob.name
+    mesh = mesh_ob.to_mesh(bpy.context.scene, False, 'PREVIEW', calc_tessface = True)
+
+    triangulate(mesh)
+    # normals per face corner, split at hard edges
+    mesh.calc_normals_split()
+
+    vertInfs = []
+    #vertex influences
+    if len(mesh_ob.vertex_groups) > 0:
+        # vertex group index -> pivot index, the names are only compared once per group
+        groupPivots = np.full(max(g.index for g in mesh_ob.vertex_groups) + 1, -1, dtype = np.int32)
+        for g in mesh_ob.vertex_groups:
+            groupPivots[g.index] = Hierarchy.FindPivot(g.name)
+            if groupPivots[g.index] < 0:
+                context.report({'ERROR'}, "vertex group %s of %s has no bone, its weights are not exported" % (g.name, mesh_ob.name))
+                print("Error: vertex group %s of %s has no bone, its weights are not exported" % (g.name, mesh_ob.name))
+        counts = np.fromiter((len(v.groups) for v in mesh.vertices), dtype = np.int32, count = len(mesh.vertices))
+        groups = np.fromiter((g.group for v in mesh.vertices for g in v.groups), dtype = np.int32, count = int(counts.sum()))
+        weights = np.fromiter((g.weight for v in mesh.vertices for g in v.groups), dtype = np.float32, count = int(counts.sum()))
+        # vertices without a weight that survives the export follow the parent bone of the mesh (or the root)
+        defaultPivot = 0
+        if not mesh_ob.parent_bone == "":
+            defaultPivot = max(Hierarchy.FindPivot(mesh_ob.parent_bone), 0)
+        boneIdx, boneInf, xtraIdx, xtraInf, dropped, unbound = mesh_w4d.ResolveVertexInfluences(counts, groups, weights, groupPivots, defaultPivot)
+        if dropped > 0:
+            context.report({'ERROR'}, "max 2 bone influences per vertex supported! (%i vertices of %s)" % (dropped, mesh_ob.name))
+            print("Error: max 2 bone influences per vertex supported! (%i vertices of %s)" % (dropped, mesh_ob.name))
+        if unbound > 0:
+            context.report({'ERROR'}, "%i vertices of %s have no bone weight of at least 0.005, they are bound to %s" % (unbound, mesh_ob.name, Hierarchy.pivots[defaultPivot].name))
+            print("Error: %i vertices of %s have no bone weight of at least 0.005, they are bound to %s" % (unbound, mesh_ob.name, Hierarchy.pivots[defaultPivot].name))
+        vertInfs = [struct_w4d.MeshVertexInfluences(boneIdx = b, boneInf = bi, xtraIdx = x, xtraInf = xi)
+            for b, bi, x, xi in zip(boneIdx.tolist(), boneInf.tolist(), xtraIdx.tolist(), xtraInf.tolist())]
+	
+    co = np.empty(len(mesh.vertices) * 3, dtype = np.float32)
+    mesh.vertices.foreach_get("co", co)
+
+    # the 3 corners (loops) of each triangle
+    loopStart = np.empty(len(mesh.polygons), dtype = np.int32)
+    mesh.polygons.foreach_get("loop_start", loopStart)
+    corners = (loopStart[:, np.newaxis] + np.arange(3, dtype = np.int32)).ravel()
+    loopVerts = np.empty(len(mesh.loops), dtype = np.int32)
+    mesh.loops.foreach_get("vertex_index", loopVerts)
+    loopNormals = np.empty(len(mesh.loops) * 3, dtype = np.float32)
+    mesh.loops.foreach_get("normal", loopNormals)
+    #uv coords
+    cornerUVs = None
+    if mesh.uv_layers.active is not None:
+        loopUVs = np.empty(len(mesh.loops) * 2, dtype = np.float32)
+        mesh.uv_layers.active.data.foreach_get("uv", loopUVs)
+        cornerUVs = loopUVs.reshape(-1, 2)[corners]
+
+    Mesh = encode_w4d.MeshSource(header = Header, co = co, cornerVerts = loopVerts[corners],
+        cornerNormals = loopNormals.reshape(-1, 3)[corners], cornerUVs = cornerUVs, vertInfs = vertInfs)
+    Mesh.materials = [] 
 	
-    for uv in uvCoords:
-        WriteFloat(file, uv[0])
-        WriteFloat(file, uv[1])
-		
-#######################################################################################
-# VertexInfluences
-#######################################################################################	
-		
-def getMeshVertexInfluencesChunkSize(influences):
-    size = len(influences) * 4
-    return size
-
-def WriteMeshVertexInfluences(file, influences):
-    WriteLong(file, 7) #chunktype
-    WriteLong(file, getMeshVertexInfluencesChunkSize(influences)) #chunksize
+    for mat in mesh.materials:
+        matName = (os.path.splitext(os.path.basename(mat.name))[1])[1:]
+        material = struct_w4d.MeshMaterial()
+        material.textures = []
+        for tex in mat.texture_slots:
+            if not (tex == None):
+                texture = struct_w4d.Texture()
+                texture.name = tex.name
+                material.textures.append(texture)
+        Mesh.materials.append(material)
+	
+    if len(mesh_ob.vertex_groups) > 0:					
+        Header.type = 128 #type skin
+    else:
+        Header.type = 0 #type normal mesh
+        pivot = struct_w4d.HierarchyPivot()
+        pivot.name = mesh_ob.name
+        pivot.parentID = 0
+        if not mesh_ob.parent_bone == "":
+            pivot.parentID = Hierarchy.FindPivot(mesh_ob.parent_bone)
+            if pivot.parentID < 0:
+                context.report({'ERROR'}, "parent bone %s of %s not found!" % (mesh_ob.parent_bone, mesh_ob.name))
+                print("Error: parent bone %s of %s not found!" % (mesh_ob.parent_bone, mesh_ob.name))
+                pivot.parentID = 0
+        pivot.isBone = 0
+        pivot.position = mesh_ob.location
+        pivot.rotation = mesh_ob.rotation_quaternion
+        Header.parentPivot = Hierarchy.AddPivot(pivot)
 
-    for inf in influences:
-        WriteShort(file, inf.boneIdx)
-        WriteShort(file, int(inf.boneInf * 100))
-		
-#######################################################################################
-# Texture
-#######################################################################################	
+    return Mesh
 
-def getTextureChunkSize(texture):
-    size = getStringSize(texture.name) + 1
-    return size
-	
-def WriteTexture(file, texture):
-    WriteLong(file, 31) #chunktype
-    WriteLong(file,  MakeChunkSize(getTextureChunkSize(texture))) #chunksize
-	
-    WriteString(file, texture.name)
-    WriteUnsignedByte(file, texture.type)
-    WriteFloat(file, texture.value)
-	
-    #write animation chunks
-		
 #######################################################################################
-# Material
-#######################################################################################	
-
-def getMaterialChunkSize(material):
-    size = 28
-    for texture in material.textures:
-        size += HEAD + getTextureChunkSize(texture)
-    return size
-
-def WriteMeshMaterial(file, material):
-    WriteLong(file, 30) #chunktype
-    WriteLong(file, MakeChunkSize(getMaterialChunkSize(material))) #chunksize
-	
-    WriteRGBA(file, material.diffuse)
-    WriteFloat(file, material.diffuse_intensity)
-    WriteRGBA(file, material.specular)
-    WriteFloat(file, material.specular_intensity)
-    WriteFloat(file, material.emit)
-    WriteFloat(file, material.alpha)
- 
-    for texture in material.textures:
-        WriteTexture(file, texture)
-		
+# Bone Pivot
 #######################################################################################
-# Mesh
-#######################################################################################	
-
-def getMeshHeaderChunkSize(header):
-    size = 51 + getStringSize(header.meshName)
-    return size
 
-def WriteMeshHeader(file, header): 
-    WriteLong(file, 2) #chunktype
-    WriteLong(file, getMeshHeaderChunkSize(header)) #chunksize
-
-    WriteUnsignedByte(file, header.type)
-    WriteString(file, header.meshName)
-    WriteShort(file, header.parentPivot)
-    WriteLong(file, header.faceCount)
-    WriteLong(file, header.vertCount)
-    WriteVector(file, header.minCorner)
-    WriteVector(file, header.maxCorner)
-    WriteVector(file, header.sphCenter)
-    WriteFloat(file, header.sphRadius)
-	
-def WriteMesh(file, mesh):
-    print("\n### NEW MESH: ###")
-    WriteLong(file, 1) #chunktype
-	
-    size = HEAD + getMeshHeaderChunkSize(mesh.header)
-    size += HEAD + getMeshVerticesChunkSize(mesh.verts)
-    size += HEAD + getMeshNormalsArrayChunkSize(mesh.normals)
-    size += HEAD + getMeshFaceArrayChunkSize(mesh.faces)
-    size += HEAD + getMeshUVCoordsChunkSize(mesh.uvCoords)
-    if len(mesh.vertInfs) > 0:
-        size += HEAD + getMeshVertexInfluencesChunkSize(mesh.vertInfs)
-    for mat in mesh.materials:
-        size += HEAD + getMaterialChunkSize(mat)
-
-    WriteLong(file, MakeChunkSize(size)) #chunksize
-	
-    WriteMeshHeader(file, mesh.header)
-    print(mesh.header.meshName)
-    #print("Header")
-    WriteMeshVerticesArray(file, mesh.verts)
-    #print("Vertices")
-    WriteMeshNormalsArray(file, mesh.normals)
-    #print("Normals")
-    WriteMeshFaceArray(file, mesh.faces)
-    #print("Faces")
-    WriteMeshUVCoords(file, mesh.uvCoords)
-    #print("uvCoords")
-    if len(mesh.vertInfs) > 0:
-        WriteMeshVertexInfluences(file, mesh.vertInfs) 
-        #print("Vertex Influences")
-    for mat in mesh.materials:
-        WriteMeshMaterial(file, mat)
-        #print("Material")
-		
-#######################################################################################
-# Mesh Sphere
-#######################################################################################	
-
-def calculateMeshSphere(mesh, Header):
-    # get the point with the biggest distance to x and store it in y
-    x = mesh.vertices[0]
-    y = mesh.vertices[1]
-    dist = ((y.co[0] - x.co[0])**2 + (y.co[1] - x.co[1])**2 + (y.co[2] - x.co[2])**2)**(1/2)
-    for v in mesh.vertices:
-        curr_dist = ((v.co[0] - x.co[0])**2 + (v.co[1] - x.co[1])**2 + (v.co[2] - x.co[2])**2)**(1/2)
-        if (curr_dist > dist):
-            dist = curr_dist
-            y = v
-					
-    #get the point with the biggest distance to y and store it in z
-    z = mesh.vertices[2]
-    dist = ((z.co[0] - y.co[0])**2 + (z.co[1] - y.co[1])**2 + (z.co[2] - y.co[2])**2)**(1/2)
-    for v in mesh.vertices:
-        curr_dist = ((v.co[0] - y.co[0])**2 + (v.co[1] - y.co[1])**2 + (v.co[2] - y.co[2])**2)**(1/2)
-        if (curr_dist > dist):
-            dist = curr_dist
-            z = v   
-             
-    # the center of the sphere is between y and z
-    vec_y = Vector(y.co.xyz)
-    vec_z = Vector(z.co.xyz)
-    y_z = ((vec_z - vec_y)/2)
-    m = Vector(vec_y + y_z)
-    radius = y_z.length
-
-    #test if any of the vertices is outside the sphere (if so update the sphere)
-    for v in mesh.vertices:
-        curr_dist = ((v.co[0] - m[0])**2 + (v.co[1] - m[1])**2 + (v.co[2] - m[2])**2)**(1/2)
-        if curr_dist > radius:
-            delta = (curr_dist - radius)/2
-            radius += delta
-            m += (Vector(v.co.xyz - m)).normalized() * delta  	 	
-    Header.sphCenter = m
-    Header.sphRadius = radius
+def bonePivot(bone, Hierarchy, context):
+    pivot = struct_w4d.HierarchyPivot()
+    pivot.name = bone.name
+    if not bone.parent == None:
+        pivot.parentID = Hierarchy.FindPivot(bone.parent.name)
+        if pivot.parentID < 0:
+            context.report({'ERROR'}, "parent bone %s of %s not found!" % (bone.parent.name, bone.name))
+            print("Error: parent bone %s of %s not found!" % (bone.parent.name, bone.name))
+            pivot.parentID = 0
+    else:
+        pivot.parentID = 0
+    pivot.position = bone.location
+    pivot.rotation = bone.rotation_quaternion
+    return pivot
 
 #######################################################################################
 # Main Export
 #######################################################################################	
 
-def MainExport(givenfilepath, self, context, EXPORT_MODE = 'M'):
+def MainExport(givenfilepath, self, context, EXPORT_MODE = 'M', EXACT_SPHERE = False, OPTIMIZE_CACHE = False, COMPACT_MESHES = True,
+        ENCODE_POOL = 'THREAD', ENCODE_WORKERS = 0, INCREMENTAL = True):
     #print("Run Export")
+    settings = encode_w4d.EncodeSettings(exactSphere = EXACT_SPHERE, optimizeCache = OPTIMIZE_CACHE)
+    if COMPACT_MESHES:
+        settings.tolerance = quantize_w4d.MeshTolerance()
     Hierarchy = struct_w4d.Hierarchy()
     amtName = ""
     modelName = ""
@@ -439,7 +160,7 @@ def MainExport(givenfilepath, self, context, EXPORT_MODE = 'M'):
     roottransform = struct_w4d.HierarchyPivot()
     roottransform.name = "ROOTTRANSFORM"
     roottransform.parentID = -1
-    Hierarchy.pivots.append(roottransform)
+    Hierarchy.AddPivot(roottransform)
     
 	#switch to object mode
     if bpy.ops.object.mode_set.poll():
@@ -451,17 +172,21 @@ def MainExport(givenfilepath, self, context, EXPORT_MODE = 'M'):
     if len(rigList) == 1:
         rig = rigList[0]
         amtName = rig.name
+        # in the order of pose.bones (already parents first) so the pivot indices do not change,
+        # a bone that comes before its parent waits and is added right after it
+        waiting = {}
         for bone in rig.pose.bones:
-            pivot = struct_w4d.HierarchyPivot()
-            pivot.name = bone.name
-            if not bone.parent == None:
-                ids = [index for index, pivot in enumerate(Hierarchy.pivots) if pivot.name == bone.parent.name] #return an array of indices (in this case only one value)
-                pivot.parentID = ids[0]
-            else:
-                pivot.parentID = 0
-            pivot.position = bone.location
-            pivot.rotation = bone.rotation_quaternion
-            Hierarchy.pivots.append(pivot)
+            if not bone.parent == None and Hierarchy.FindPivot(bone.parent.name) < 0:
+                waiting.setdefault(bone.parent.name, []).append(bone)
+                continue
+            stack = [bone]
+            while len(stack) > 0:
+                bone = stack.pop()
+                Hierarchy.AddPivot(bonePivot(bone, Hierarchy, context))
+                stack.extend(reversed(waiting.pop(bone.name, [])))
+        for bones in list(waiting.values()):
+            for bone in bones:
+                Hierarchy.AddPivot(bonePivot(bone, Hierarchy, context))
     else:
         context.report({'ERROR'}, "only one armature allowed!")
         print("Error: only one armature allowed!") 
@@ -479,8 +204,11 @@ def MainExport(givenfilepath, self, context, EXPORT_MODE = 'M'):
             Model = struct_w4d.Model()
             Model.name = modelName
             Model.hieraName = amtName
-            WriteModel(sknFile, Model)
+            writer_w4d.WriteModel(sknFile, Model)
 		
+        # the meshes are extracted in scene order and encoded in the pool afterwards,
+        # the chunks keep the order of the scene
+        chunks = []
         for mesh_ob in objList: 
             if mesh_ob.name == "BOUNDINGBOX":
                 Box = struct_w4d.Box()
@@ -488,118 +216,25 @@ def MainExport(givenfilepath, self, context, EXPORT_MODE = 'M'):
                 box_mesh = mesh_ob.to_mesh(bpy.context.scene, False, 'PREVIEW', calc_tessface = True)
                 Box.extend = Vector((box_mesh.vertices[0].co.x * 2, box_mesh.vertices[0].co.y * 2, box_mesh.vertices[0].co.z))
 			
-                if not EXPORT_MODE == 'S':
-                    WriteBox(sknFile, Box)
+                boxFile = io.BytesIO()
+                writer_w4d.WriteBox(boxFile, Box)
+                chunks.append(boxFile.getvalue())
             else:
-                Mesh = struct_w4d.Mesh()
-                Header = struct_w4d.MeshHeader()			
-		
-                verts = []
-                normals = [] 
-                faces = []
-                uvs = []
-                vertInfs = []
+                chunks.append(extractMesh(mesh_ob, Hierarchy, context))
 
-                Header.meshName = mesh_ob.name
-                mesh = mesh_ob.to_mesh(bpy.context.scene, False, 'PREVIEW', calc_tessface = True)
-		
-                triangulate(mesh)
-		
-                Header.vertCount = len(mesh.vertices)
-                Mesh.vertInfs = []
-                group_lookup = {g.index: g.name for g in mesh_ob.vertex_groups}
-                groups = {name: [] for name in group_lookup.values()}
-                for v in mesh.vertices:
-                    verts.append(v.co.xyz)
-                    normals.append(v.normal)
-                    uvs.append((0.0, 0.0)) #just to fill the array 
-				
-				    #vertex influences
-                    vertInf = struct_w4d.MeshVertexInfluences()
-                    if len(v.groups) > 0:
-				        #has to be this complicated, otherwise the vertex groups would be corrupted
-                        ids = [index for index, pivot in enumerate(Hierarchy.pivots) if pivot.name == mesh_ob.vertex_groups[v.groups[0].group].name] #return an array of indices (in this case only one value)
-                        if len(ids) > 0:
-                            vertInf.boneIdx = ids[0]
-                        vertInf.boneInf = v.groups[0].weight
-                        Mesh.vertInfs.append(vertInf)
-                    elif len(v.groups) > 1:
-                        #has to be this complicated, otherwise the vertex groups would be corrupted
-                        ids = [index for index, pivot in enumerate(Hierarchy.pivots) if pivot.name == mesh_ob.vertex_groups[v.groups[0].group].name] #return an array of indices (in this case only one value)
-                        if len(ids) > 0:
-                            vertInf.boneIdx = ids[0]
-                        vertInf.boneInf = v.groups[0].weight
-                        #has to be this complicated, otherwise the vertex groups would be corrupted
-                        ids = [index for index, pivot in enumerate(Hierarchy.pivots) if pivot.name == mesh_ob.vertex_groups[v.groups[1].group].name] #return an array of indices (in this case only one value)
-                        if len(ids) > 0:
-                            vertInf.boneIdx = ids[0]
-                        vertInf.xtraInf = v.groups[1].weight
-                        Mesh.vertInfs.append(vertInf)
-                    elif len(v.groups) > 2: 
-                        context.report({'ERROR'}, "max 2 bone influences per vertex supported!")
-                        print("Error: max 2 bone influences per vertex supported!")
-	
-                calculateMeshSphere(mesh, Header)
-			
-                Mesh.verts = verts
-                Mesh.normals = normals
-                Header.minCorner = Vector((mesh_ob.bound_box[0][0], mesh_ob.bound_box[0][1], mesh_ob.bound_box[0][2]))
-                Header.maxCorner =  Vector((mesh_ob.bound_box[6][0], mesh_ob.bound_box[6][1], mesh_ob.bound_box[6][2]))
-
-                for face in mesh.polygons:
-                    faces.append((face.vertices[0], face.vertices[1], face.vertices[2]))
-                Mesh.faces = faces
-			
-                Header.faceCount = len(faces)
-			
-		        #uv coords
-                bm = bmesh.new()
-                bm.from_mesh(mesh)
-
-                uv_layer = bm.loops.layers.uv.verify()
-                #bm.faces.layers.tex.verify()
-			
-                index = 0
-                for f in bm.faces:
-                    uvs[Mesh.faces[index][0]] = f.loops[0][uv_layer].uv
-                    uvs[Mesh.faces[index][1]] = f.loops[1][uv_layer].uv
-                    uvs[Mesh.faces[index][2]] = f.loops[2][uv_layer].uv
-                    index+=1   
-				
-                Mesh.uvCoords = uvs
-                Mesh.materials = [] 
-                meshMaterial = struct_w4d.MeshMaterial()
-			
-                for mat in mesh.materials:
-                    matName = (os.path.splitext(os.path.basename(mat.name))[1])[1:]
-                    material = struct_w4d.MeshMaterial()
-                    material.textures = []
-                    for tex in mat.texture_slots:
-                        if not (tex == None):
-                            texture = struct_w4d.Texture()
-                            texture.name = tex.name
-                            material.textures.append(texture)
-                    Mesh.materials.append(material)
-			
-                if len(mesh_ob.vertex_groups) > 0:					
-                    Header.type = 128 #type skin
-                else:
-                    Header.type = 0 #type normal mesh
-                    pivot = struct_w4d.HierarchyPivot()
-                    pivot.name = mesh_ob.name
-                    pivot.parentID = 0
-                    if not mesh_ob.parent_bone == "":
-                        ids = [index for index, pivot in enumerate(Hierarchy.pivots) if pivot.name == mesh_ob.parent_bone] #return an array of indices (in this case only one value)
-                        pivot.parentID = ids[0]
-                    pivot.isBone = 0
-                    pivot.position = mesh_ob.location
-                    pivot.rotation = mesh_ob.rotation_quaternion
-                    Header.parentPivot = len(Hierarchy.pivots)
-                    Hierarchy.pivots.append(pivot)	
-
-                Mesh.header = Header	
-                if not EXPORT_MODE == 'S':				
-                    WriteMesh(sknFile, Mesh)
+        if not EXPORT_MODE == 'S':
+            sources = [chunk for chunk in chunks if isinstance(chunk, encode_w4d.MeshSource)]
+            cache = None
+            if INCREMENTAL:
+                cache = cache_w4d.ChunkCache.ForFile(givenfilepath)
+            encoded = iter(encode_w4d.EncodeMeshes(sources, settings, ENCODE_POOL, ENCODE_WORKERS, cache))
+            for chunk in chunks:
+                if isinstance(chunk, encode_w4d.MeshSource):
+                    chunk = next(encoded)
+                sknFile.write(chunk)
+            if cache is not None:
+                # only the meshes of this export are kept
+                cache.Prune()
 
     Hierarchy.header.pivotCount = len(Hierarchy.pivots)
 		
@@ -610,13 +245,13 @@ def MainExport(givenfilepath, self, context, EXPORT_MODE = 'M'):
     if EXPORT_MODE == 'S':
         sklFile = open(sklPath.replace(sklName, amtName.lower()), "wb")
         Hierarchy.header.name = amtName
-        WriteHierarchy(sklFile, Hierarchy)
+        writer_w4d.WriteHierarchy(sklFile, Hierarchy)
         sklFile.close()
 				
     #write the hierarchy to the skn file (has no armature data)
     elif EXPORT_MODE == 'HAM':
         Hierarchy.header.name = modelName	  
-        WriteHierarchy(sknFile, Hierarchy)
+        writer_w4d.WriteHierarchy(sknFile, Hierarchy)
     try:
         sknFile.close()  
     except:
@@ -0,0 +1,175 @@
+#Prepares the mesh data of the W4D Format as flat arrays for blender (does not need blender)
+import numpy as np
+from .struct_w4d import Struct
+
+#######################################################################################
+# Mesh Layout
+#######################################################################################
+
+# flat arrays that can be passed to foreach_set of the blender mesh collections
+class MeshLayout(Struct):
+    co = None # float32 3*V (vertices.co)
+    loopVerts = None # int32 3*F (loops.vertex_index)
+    loopStart = None # int32 F (polygons.loop_start)
+    loopTotal = None # int32 F (polygons.loop_total)
+    loopUVs = None # float32 2*3*F (uv_layers[].data.uv) or None
+
+    def vertCount(self):
+        return len(self.co) // 3
+
+    def loopCount(self):
+        return len(self.loopVerts)
+
+    def faceCount(self):
+        return len(self.loopStart)
+
+# the uv coords do not cover all vertices of the faces, the mesh can still be built without them
+class UVMismatchError(Exception):
+    pass
+
+# the uv coords are stored per vertex, blender wants them per face corner.
+# raises IndexError if a face references a missing vertex and UVMismatchError for missing uv coords
+def BuildMeshLayout(verts, faces, uvCoords = None):
+    verts = np.asarray(verts, dtype = np.float32).reshape(-1, 3)
+    faces = np.asarray(faces, dtype = np.uint32).reshape(-1, 3)
+    if len(faces) > 0 and int(faces.max()) >= len(verts):
+        raise IndexError("face references vertex %i of %i" % (int(faces.max()), len(verts)))
+    corners = faces.ravel()
+    layout = MeshLayout(
+        co = np.ascontiguousarray(verts).ravel(),
+        loopVerts = corners.astype(np.int32),
+        loopStart = np.arange(0, len(corners), 3, dtype = np.int32),
+        loopTotal = np.full(len(faces), 3, dtype = np.int32),
+        loopUVs = None)
+    if uvCoords is not None and len(uvCoords) > 0:
+        uvCoords = np.asarray(uvCoords, dtype = np.float32).reshape(-1, 2)
+        if len(corners) > 0 and int(corners.max()) >= len(uvCoords):
+            raise UVMismatchError("face references uv coord %i of %i" % (int(corners.max()), len(uvCoords)))
+        layout.loopUVs = uvCoords[corners].ravel()
+    return layout
+
+#######################################################################################
+# Vertex Indexer
+#######################################################################################
+
+# vertex buffer of the W4D Format, one entry per distinct (vertex, normal, uv) corner
+class IndexedMesh(Struct):
+    verts = None # float32 Nx3
+    normals = None # float32 Nx3
+    uvCoords = None # float32 Nx2
+    faces = None # uint32 Fx3
+    vertMap = None # int32 N, the source vertex of each entry (for the vertex influences)
+
+# blender stores normals and uvs per face corner, the W4D Format per vertex. corners of a vertex
+# with the same normal and uv share one entry, the others (hard edges, uv seams) get their own.
+# co is (V, 3), cornerVerts the source vertex of each of the 3*F corners, cornerNormals (3*F, 3)
+# and cornerUVs (3*F, 2). the entries are numbered in the order the faces first use them
+def IndexCorners(co, cornerVerts, cornerNormals, cornerUVs = None):
+    co = np.asarray(co, dtype = np.float32).reshape(-1, 3)
+    cornerVerts = np.asarray(cornerVerts, dtype = np.uint32).ravel()
+    cornerCount = len(cornerVerts)
+    if cornerUVs is None:
+        cornerUVs = np.zeros((cornerCount, 2), dtype = np.float32)
+    # + 0.0 turns -0.0 into 0.0, so only the bit patterns have to be compared
+    cornerNormals = np.asarray(cornerNormals, dtype = np.float32).reshape(-1, 3) + np.float32(0.0)
+    cornerUVs = np.asarray(cornerUVs, dtype = np.float32).reshape(-1, 2) + np.float32(0.0)
+
+    keys = np.empty((cornerCount, 6), dtype = np.uint32)
+    keys[:, 0] = cornerVerts
+    keys[:, 1:4] = cornerNormals.view(np.uint32)
+    keys[:, 4:6] = cornerUVs.view(np.uint32)
+    keys = keys.view(np.dtype((np.void, keys.dtype.itemsize * 6))).ravel()
+    unique, first, inverse = np.unique(keys, return_index = True, return_inverse = True)
+
+    # np.unique sorts by key, renumber by first use
+    order = np.argsort(first, kind = "stable")
+    rank = np.empty(len(order), dtype = np.uint32)
+    rank[order] = np.arange(len(order), dtype = np.uint32)
+    first = first[order]
+    return IndexedMesh(
+        verts = co[cornerVerts[first]],
+        normals = cornerNormals[first],
+        uvCoords = cornerUVs[first],
+        faces = rank[inverse.ravel()].reshape(-1, 3),
+        vertMap = cornerVerts[first].astype(np.int32))
+
+#######################################################################################
+# Vertex Weights
+#######################################################################################
+
+# flattens MeshVertexInfluences into (vertex, bone, weight) arrays. a weight of 0 means the
+# vertex is fully bound to its bone, a second influence (xtraIdx/xtraInf) is added if present
+def InfluenceArrays(vertInfs):
+    count = len(vertInfs)
+    verts = np.arange(count, dtype = np.int32)
+    bones = np.fromiter((inf.boneIdx for inf in vertInfs), dtype = np.int32, count = count)
+    weights = np.fromiter((inf.boneInf for inf in vertInfs), dtype = np.float32, count = count)
+    weights[weights == 0.0] = 1.0
+    xtraWeights = np.fromiter((getattr(inf, "xtraInf", 0.0) for inf in vertInfs), dtype = np.float32, count = count)
+    xtra = np.nonzero(xtraWeights > 0.0)[0]
+    if len(xtra) > 0:
+        xtraBones = np.array([vertInfs[i].xtraIdx for i in xtra], dtype = np.int32)
+        verts = np.concatenate((verts, verts[xtra]))
+        bones = np.concatenate((bones, xtraBones))
+        weights = np.concatenate((weights, xtraWeights[xtra]))
+    return verts, bones, weights
+
+# groups the vertices by (bone, weight) so each group needs only one vertex_groups[bone].add call.
+# returns a list of (bone, weight, vertex indices)
+def PlanVertexWeights(verts, bones, weights):
+    verts = np.asarray(verts, dtype = np.int32)
+    bones = np.asarray(bones, dtype = np.int32)
+    weights = np.asarray(weights, dtype = np.float32)
+    if len(verts) == 0:
+        return []
+    order = np.lexsort((verts, weights, bones))
+    bones = bones[order]
+    weights = weights[order]
+    verts = verts[order]
+    starts = np.nonzero(np.concatenate(([True], (bones[1:] != bones[:-1]) | (weights[1:] != weights[:-1]))))[0]
+    ends = np.append(starts[1:], len(verts))
+    return [(int(bones[s]), float(weights[s]), verts[s:e]) for s, e in zip(starts, ends)]
+
+# picks the two heaviest influences of each vertex. counts holds the number of groups per vertex,
+# groups and weights the (vertex group, weight) pairs of all vertices one after another and
+# groupPivots the pivot index of each vertex group (-1 for groups without a pivot, they are ignored).
+# vertices without any of these groups (or whose weights round to 0 in the file) are bound to defaultPivot with full weight.
+# returns boneIdx, boneInf, xtraIdx, xtraInf arrays, the number of vertices with more influences
+# and the number of vertices bound to defaultPivot
+def ResolveVertexInfluences(counts, groups, weights, groupPivots, defaultPivot = 0):
+    counts = np.asarray(counts, dtype = np.int32)
+    groupPivots = np.asarray(groupPivots, dtype = np.int32)
+    count = len(counts)
+    boneIdx = np.zeros(count, dtype = np.int32)
+    boneInf = np.zeros(count, dtype = np.float32)
+    xtraIdx = np.zeros(count, dtype = np.int32)
+    xtraInf = np.zeros(count, dtype = np.float32)
+    verts = np.repeat(np.arange(count, dtype = np.int32), counts)
+    pivots = groupPivots[np.asarray(groups, dtype = np.int32)] if len(groupPivots) > 0 else np.full(len(verts), -1, dtype = np.int32)
+    weights = np.asarray(weights, dtype = np.float32)
+    mapped = pivots >= 0
+    verts = verts[mapped]
+    pivots = pivots[mapped]
+    weights = weights[mapped]
+
+    # sort by vertex, heaviest influence first
+    order = np.lexsort((-weights, verts))
+    verts = verts[order]
+    pivots = pivots[order]
+    weights = weights[order]
+    rank = np.arange(len(verts)) - np.searchsorted(verts, verts)
+
+    first = rank == 0
+    boneIdx[verts[first]] = pivots[first]
+    boneInf[verts[first]] = weights[first]
+    second = rank == 1
+    xtraIdx[verts[second]] = pivots[second]
+    xtraInf[verts[second]] = weights[second]
+    # the writer stores round(weight * 100) and a stored 0 is read back as full weight,
+    # so vertices whose heaviest weight rounds to 0 get a real binding
+    unbound = np.ones(count, dtype = bool)
+    unbound[verts[first & (np.round(weights.astype(np.float64) * 100) >= 1)]] = False
+    boneIdx[unbound] = defaultPivot
+    boneInf[unbound] = 1.0
+    xtraInf[unbound] = 0.0
+    return boneIdx, boneInf, xtraIdx, xtraInf, len(np.unique(verts[rank == 2])), int(unbound.sum())
@@ -0,0 +1,156 @@
+#Reorders the triangles and vertices of the W4D meshes for the vertex cache (does not need blender)
+import collections
+import numpy as np
+from .struct_w4d import Struct
+
+#######################################################################################
+# Statistics
+#######################################################################################
+
+# size of the post transform cache the statistics are measured with
+FIFO_SIZE = 16
+
+class CacheStats(Struct):
+    acmr = 0.0 # average cache miss ratio, transformed vertices per triangle (0.5 - 3.0)
+    atvr = 0.0 # average transformed vertex ratio, transformed vertices per vertex (1.0 - 3.0 * F / V)
+
+# simulates a fifo cache of the given size over the triangle list
+def CacheStatistics(faces, cacheSize = FIFO_SIZE):
+    faces = np.asarray(faces, dtype = np.int64).reshape(-1, 3)
+    if len(faces) == 0:
+        return CacheStats(acmr = 0.0, atvr = 0.0)
+    cache = collections.deque()
+    cached = set()
+    misses = 0
+    for v in faces.ravel().tolist():
+        if not v in cached:
+            misses += 1
+            cache.append(v)
+            cached.add(v)
+            if len(cache) > cacheSize:
+                cached.discard(cache.popleft())
+    return CacheStats(acmr = misses / len(faces), atvr = misses / len(np.unique(faces)))
+
+#######################################################################################
+# Vertex Cache
+#######################################################################################
+
+# tom forsyth, linear-speed vertex cache optimisation
+CACHE_SIZE = 32
+CACHE_DECAY_POWER = 1.5
+LAST_TRI_SCORE = 0.75
+VALENCE_BOOST_SCALE = 2.0
+VALENCE_BOOST_POWER = 0.5
+
+def CacheScores():
+    scores = [LAST_TRI_SCORE] * 3
+    for pos in range(3, CACHE_SIZE):
+        scores.append((1.0 - (pos - 3) / (CACHE_SIZE - 3)) ** CACHE_DECAY_POWER)
+    return scores
+
+def ValenceScores(maxValence):
+    return [0.0] + [VALENCE_BOOST_SCALE * n ** -VALENCE_BOOST_POWER for n in range(1, maxValence + 1)]
+
+# returns the faces in an order that reuses the vertices still in the cache
+def OptimizeVertexCache(faces):
+    faces = np.asarray(faces, dtype = np.int64).reshape(-1, 3)
+    faceCount = len(faces)
+    if faceCount == 0:
+        return faces.astype(np.uint32)
+    vertCount = int(faces.max()) + 1
+
+    # triangles of each vertex
+    corners = faces.ravel()
+    valence = np.bincount(corners, minlength = vertCount)
+    starts = np.concatenate(([0], np.cumsum(valence)[:-1])).tolist()
+    vertTris = (np.argsort(corners, kind = "stable") // 3).tolist()
+    remaining = valence.tolist()
+    triVerts = faces.tolist()
+
+    cacheScores = CacheScores()
+    valenceScores = ValenceScores(int(valence.max()))
+    cachePos = [-1] * vertCount
+    vertScore = [valenceScores[n] for n in remaining]
+    triScore = (np.array(vertScore)[faces].sum(axis = 1)).tolist()
+    added = [False] * faceCount
+
+    cache = []
+    order = []
+    best = int(np.argmax(triScore))
+    while len(order) < faceCount:
+        if best < 0:
+            # the cache ran dry (new mesh part), take the best triangle left
+            scores = np.array(triScore)
+            scores[np.array(added)] = -1.0
+            best = int(np.argmax(scores))
+        tri = triVerts[best]
+        order.append(best)
+        added[best] = True
+        triScore[best] = -1.0
+
+        for v in tri:
+            # remove the triangle from the active triangles of the vertex
+            start = starts[v]
+            end = start + remaining[v]
+            for i in range(start, end):
+                if vertTris[i] == best:
+                    vertTris[i] = vertTris[end - 1]
+                    vertTris[end - 1] = best
+                    break
+            remaining[v] -= 1
+
+        newCache = tri + [v for v in cache if not v in tri]
+        for v in newCache[CACHE_SIZE:]:
+            cachePos[v] = -1
+        cache = newCache[:CACHE_SIZE]
+
+        # rescore the vertices in the cache and the triangles using them
+        best = -1
+        bestScore = -1.0
+        touched = set()
+        for pos, v in enumerate(cache):
+            cachePos[v] = pos
+            score = cacheScores[pos] + valenceScores[remaining[v]] if remaining[v] > 0 else -1.0
+            delta = score - vertScore[v]
+            vertScore[v] = score
+            start = starts[v]
+            for i in range(start, start + remaining[v]):
+                t = vertTris[i]
+                triScore[t] += delta
+                touched.add(t)
+        for t in touched:
+            if triScore[t] > bestScore:
+                best = t
+                bestScore = triScore[t]
+        for v in newCache[CACHE_SIZE:]:
+            score = valenceScores[remaining[v]] if remaining[v] > 0 else -1.0
+            delta = score - vertScore[v]
+            vertScore[v] = score
+            start = starts[v]
+            for i in range(start, start + remaining[v]):
+                triScore[vertTris[i]] += delta
+    return faces[np.array(order)].astype(np.uint32)
+
+#######################################################################################
+# Vertex Fetch
+#######################################################################################
+
+# numbers the vertices in the order the faces first use them, unused vertices go to the end.
+# returns the remapped faces and the old index of each new vertex (to reorder the vertex arrays)
+def OptimizeVertexFetch(faces, vertCount):
+    faces = np.asarray(faces, dtype = np.int64).reshape(-1, 3)
+    corners = faces.ravel()
+    used, first = np.unique(corners, return_index = True)
+    unused = np.setdiff1d(np.arange(vertCount), used)
+    vertOrder = np.concatenate((used[np.argsort(first, kind = "stable")], unused)).astype(np.int64)
+    remap = np.empty(vertCount, dtype = np.int64)
+    remap[vertOrder] = np.arange(vertCount)
+    return remap[corners].reshape(-1, 3).astype(np.uint32), vertOrder
+
+# reorders the triangles and then the vertices of the mesh arrays, returns
+# the new faces, the vertex order and the statistics before and after
+def OptimizeMesh(faces, vertCount):
+    before = CacheStatistics(faces)
+    faces = OptimizeVertexCache(faces)
+    faces, vertOrder = OptimizeVertexFetch(faces, vertCount)
+    return faces, vertOrder, before, CacheStatistics(faces)
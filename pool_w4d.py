@@ -0,0 +1,27 @@
+#Starts process pools whose workers load the bpy-free modules of this addon (does not need blender)
+import multiprocessing
+import sys
+
+# runs in every worker before the first task (passed to exec, so nothing has to be imported for it).
+# registers the package without running its __init__.py, which needs bpy
+BOOTSTRAP = """
+import sys, types
+if not name in sys.modules:
+    package = types.ModuleType(name)
+    package.__path__ = [directory]
+    sys.modules[name] = package
+"""
+
+# inside blender sys.executable is the blender binary, the workers need the bundled python
+def PythonExecutable():
+    try:
+        import bpy
+    except ImportError:
+        return sys.executable
+    return getattr(bpy.app, "binary_path_python", sys.executable) or sys.executable
+
+# keyword arguments for a ProcessPoolExecutor that loads the package from directory as name
+def PoolArguments(name, directory):
+    context = multiprocessing.get_context("spawn")
+    context.set_executable(PythonExecutable())
+    return {"mp_context": context, "initializer": exec, "initargs": (BOOTSTRAP, {"name": name, "directory": directory})}
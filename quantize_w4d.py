@@ -0,0 +1,118 @@
+#Quantizes the vertex streams of the compact mesh chunks 9 - 12 (does not need blender)
+import numpy as np
+from .struct_w4d import Struct
+
+# biggest error the exporter accepts for the compact chunks, otherwise it writes the float chunks
+class MeshTolerance(Struct):
+    position = 0.001 # blender units per axis
+    normal = 0.001 # per component of the unit normal
+    uv = 0.0005
+
+def MaxError(a, b):
+    if len(a) == 0:
+        return 0.0
+    return float(np.abs(np.asarray(a, dtype = np.float64) - b).max())
+
+#######################################################################################
+# Positions (chunk 9)
+#######################################################################################
+
+QUANT_MAX = 65535
+
+# uint16 per axis inside the bounding box of the MeshHeader
+def QuantizePositions(verts, minCorner, maxCorner):
+    verts = np.asarray(verts, dtype = np.float32).reshape(-1, 3)
+    lo = np.asarray(minCorner, dtype = np.float32)
+    extent = np.asarray(maxCorner, dtype = np.float32) - lo
+    scale = np.where(extent > 0, QUANT_MAX / np.where(extent > 0, extent, 1), 0).astype(np.float64)
+    q = np.rint((verts - lo) * scale)
+    return np.clip(q, 0, QUANT_MAX).astype("<u2")
+
+def DequantizePositions(quantized, minCorner, maxCorner):
+    lo = np.asarray(minCorner, dtype = np.float32)
+    extent = np.asarray(maxCorner, dtype = np.float32) - lo
+    return (lo + quantized.astype(np.float32) * (extent / np.float32(QUANT_MAX))).astype(np.float32)
+
+#######################################################################################
+# Normals (chunk 10)
+#######################################################################################
+
+SNORM_MAX = 32767
+
+# octahedral mapping of the unit normals, two int16 per normal
+def EncodeOctahedral(normals):
+    normals = np.asarray(normals, dtype = np.float64).reshape(-1, 3)
+    length = np.abs(normals).sum(axis = 1, keepdims = True)
+    n = np.where(length > 0, normals / np.where(length > 0, length, 1), (0.0, 0.0, 1.0))
+    x = n[:, 0]
+    y = n[:, 1]
+    # fold the lower half over the diagonals
+    back = n[:, 2] < 0
+    signX = np.where(x >= 0, 1.0, -1.0)
+    signY = np.where(y >= 0, 1.0, -1.0)
+    ox = np.where(back, (1.0 - np.abs(y)) * signX, x)
+    oy = np.where(back, (1.0 - np.abs(x)) * signY, y)
+    return np.rint(np.stack((ox, oy), axis = 1) * SNORM_MAX).astype("<i2")
+
+def DecodeOctahedral(encoded):
+    e = np.maximum(encoded.astype(np.float32) / SNORM_MAX, -1.0)
+    x = e[:, 0]
+    y = e[:, 1]
+    z = 1.0 - np.abs(x) - np.abs(y)
+    t = np.maximum(-z, 0.0)
+    x = x - np.where(x >= 0, t, -t)
+    y = y - np.where(y >= 0, t, -t)
+    n = np.stack((x, y, z), axis = 1)
+    return (n / np.linalg.norm(n, axis = 1, keepdims = True)).astype(np.float32)
+
+#######################################################################################
+# uvCoords (chunk 11)
+#######################################################################################
+
+def EncodeHalf(uvCoords):
+    return np.asarray(uvCoords, dtype = np.float32).reshape(-1, 2).astype("<f2")
+
+def DecodeHalf(encoded):
+    return encoded.astype(np.float32)
+
+#######################################################################################
+# Quaternions (chunk 514 with vectorLen SMALLEST_THREE)
+#######################################################################################
+
+# vectorLen of the time coded channels whose quaternions are packed into 48 bits
+SMALLEST_THREE = 0x8004
+
+# the other components of a unit quaternion are at most this big if the largest is left out
+SMALLEST_RANGE = 0.5 ** 0.5
+SMALLEST_MAX = 0x7FFF
+
+# biggest angle (radians) between a unit quaternion and its unpacked one, measured like
+# animation_w4d.KeyErrors does on the float32 result of UnpackQuaternions (max seen 6.71e-4)
+PACKED_ANGLE_ERROR = 6.8e-4
+
+# (N, 4) wxyz quaternions -> (N, 3) uint16. the largest component is dropped (and made positive
+# by flipping the sign of the quaternion), the other three get 15 bits each and the index of the
+# dropped one is stored in the top bits of the first two values
+def PackQuaternions(quats):
+    q = np.asarray(quats, dtype = np.float64).reshape(-1, 4)
+    q = q / np.linalg.norm(q, axis = 1, keepdims = True)
+    count = len(q)
+    largest = np.argmax(np.abs(q), axis = 1)
+    q = q * np.where(q[np.arange(count), largest] < 0, -1.0, 1.0)[:, np.newaxis]
+    others = (largest[:, np.newaxis] + np.arange(1, 4)) % 4
+    small = q[np.arange(count)[:, np.newaxis], others]
+    packed = np.rint((np.clip(small, -SMALLEST_RANGE, SMALLEST_RANGE) + SMALLEST_RANGE) / (2 * SMALLEST_RANGE) * SMALLEST_MAX).astype(np.uint16)
+    packed[:, 0] |= ((largest & 1) << 15).astype(np.uint16)
+    packed[:, 1] |= ((largest >> 1) << 15).astype(np.uint16)
+    return packed.astype("<u2")
+
+def UnpackQuaternions(packed):
+    packed = np.asarray(packed, dtype = np.uint16).reshape(-1, 3)
+    count = len(packed)
+    largest = (packed[:, 0] >> 15) | ((packed[:, 1] >> 15) << 1)
+    small = (packed & SMALLEST_MAX).astype(np.float32) / SMALLEST_MAX * (2 * SMALLEST_RANGE) - SMALLEST_RANGE
+    q = np.empty((count, 4), dtype = np.float32)
+    others = (largest[:, np.newaxis].astype(np.int64) + np.arange(1, 4)) % 4
+    q[np.arange(count)[:, np.newaxis], others] = small
+    q[np.arange(count), largest] = np.sqrt(np.maximum(1.0 - np.sum(small * small, axis = 1), 0.0))
+    return q
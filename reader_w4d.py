@@ -0,0 +1,813 @@
+#Written by Michael Schnabel
+#Last Modification 19.10.2015
+#Reads the W4D Format into the structs of struct_w4d (does not need blender)
+import collections
+import mmap
+import os
+import struct
+import sys
+import numpy as np
+from . import struct_w4d, quantize_w4d
+from .struct_w4d import Vector, Quaternion
+
+#######################################################################################
+# Mapped File
+#######################################################################################
+
+# read only file backed by mmap, chunk payloads can be taken as memoryviews without copying
+class MappedFile:
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.size = os.fstat(self.file.fileno()).st_size
+        if self.size > 0:
+            self.data = mmap.mmap(self.file.fileno(), 0, access = mmap.ACCESS_READ)
+        else:
+            self.data = b""
+        self.buffer = memoryview(self.data)
+        self.pos = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, offset, whence = 0):
+        if whence == 1:
+            offset += self.pos
+        elif whence == 2:
+            offset += self.size
+        self.pos = offset
+        return self.pos
+
+    def read(self, size = -1):
+        return bytes(self.view(size))
+
+    # same as read but returns a memoryview on the mapped pages
+    def view(self, size = -1):
+        end = self.size if size < 0 else min(self.pos + size, self.size)
+        data = self.buffer[self.pos:end]
+        self.pos = end
+        return data
+
+    def close(self):
+        self.file.close()
+        self.buffer.release()
+        try:
+            self.data.close()
+        except (AttributeError, BufferError):
+            # arrays still reference the pages, the mapping is freed with the last of them
+            pass
+
+def OpenFile(path, mapped = True):
+    if mapped:
+        return MappedFile(path)
+    return open(path, "rb")
+
+def GetFileSize(file):
+    if isinstance(file, MappedFile):
+        return file.size
+    pos = file.tell()
+    file.seek(0, 2)
+    size = file.tell()
+    file.seek(pos, 0)
+    return size
+
+#######################################################################################
+# Basic Methods
+#######################################################################################
+
+# finds the terminator in the mapped data or in the read buffer instead of reading byte by byte
+def ReadString(file):
+    if isinstance(file, MappedFile):
+        end = file.data.find(b"\0", file.pos)
+        if end < 0:
+            end = file.size
+        string = str(file.view(end - file.pos), "utf-8")
+        file.seek(1, 1)
+        return string
+    if not hasattr(file, "peek"):
+        bytes = []
+        b = file.read(1)
+        while len(b) > 0 and b != b"\0":
+            bytes.append(b)
+            b = file.read(1)
+        return (b"".join(bytes)).decode("utf-8")
+    parts = []
+    while True:
+        block = file.peek(256)
+        if len(block) == 0:
+            break
+        end = block.find(b"\0")
+        if end >= 0:
+            parts.append(file.read(end + 1)[:-1])
+            break
+        parts.append(file.read(len(block)))
+    return (b"".join(parts)).decode("utf-8")
+
+def ReadRGBA(file):
+    return struct_w4d.RGBA(r=ord(file.read(1)), g=ord(file.read(1)), b=ord(file.read(1)), a=ord(file.read(1)))
+
+def GetChunkSize(data):
+    return (data & 0x7FFFFFFF)
+
+def ReadLong(file):
+    #binary_format = "<l" long
+    return (struct.unpack("<L", file.read(4))[0])
+
+def ReadShort(file):
+    #binary_format = "<h" short
+    return (struct.unpack("<H", file.read(2))[0])
+
+def ReadSignedShort(file):
+    return (struct.unpack("<h", file.read(2))[0])
+
+def ReadLongArray(file,chunkEnd):
+    LongArray = []
+    while file.tell() < chunkEnd:
+        LongArray.append(ReadLong(file))
+    return LongArray
+
+def ReadFloat(file):
+    #binary_format = "<f" float
+    return (struct.unpack("f", file.read(4))[0])
+
+def ReadSignedByte(file):
+    return (struct.unpack("<b", file.read(1))[0])
+
+def ReadUnsignedByte(file):
+    return (struct.unpack("<B", file.read(1))[0])
+
+def ReadVector(file):
+    return Vector((ReadFloat(file), ReadFloat(file), ReadFloat(file)))
+
+def ReadQuaternion(file):
+    quat = (ReadFloat(file), ReadFloat(file), ReadFloat(file), ReadFloat(file))
+    #change order from xyzw to wxyz
+    return Quaternion((quat[3], quat[0], quat[1], quat[2]))
+
+# reads the rest of the chunk with a single call, without copying if the file is mapped
+def ReadChunkData(file, chunkEnd):
+    if isinstance(file, MappedFile):
+        return file.view(chunkEnd - file.tell())
+    return file.read(chunkEnd - file.tell())
+
+# decodes the rest of the chunk into a (N, width) array
+def ReadArray(file, chunkEnd, dtype, width):
+    data = ReadChunkData(file, chunkEnd)
+    dtype = np.dtype(dtype)
+    count = len(data) // (dtype.itemsize * width)
+    return np.frombuffer(data, dtype = dtype, count = count * width).reshape(count, width)
+
+# decodes the rest of the chunk into a structured array of records
+def ReadRecords(file, chunkEnd, dtype):
+    data = ReadChunkData(file, chunkEnd)
+    dtype = np.dtype(dtype)
+    return np.frombuffer(data, dtype = dtype, count = len(data) // dtype.itemsize)
+
+#######################################################################################
+# Hierarchy
+#######################################################################################
+
+def ReadHierarchyHeader(file):
+    HierarchyHeader = struct_w4d.HierarchyHeader()
+    HierarchyHeader.name = ReadString(file)
+    HierarchyHeader.pivotCount = ReadLong(file)
+    HierarchyHeader.centerPos = ReadVector(file)
+    return HierarchyHeader
+
+def ReadPivots(file, chunkEnd):
+    pivots = []
+    while file.tell() < chunkEnd:
+        pivot = struct_w4d.HierarchyPivot()
+        pivot.name = ReadString(file)
+        pivot.parentID = ReadSignedShort(file)
+        pivot.isBone = ReadUnsignedByte(file)
+        pivot.position = ReadVector(file)
+        pivot.rotation = ReadQuaternion(file)
+        pivots.append(pivot)
+    return pivots
+
+def ReadHierarchy(file, self, chunkEnd):
+    #print("\n### NEW HIERARCHY: ###")
+    HierarchyHeader = struct_w4d.HierarchyHeader()
+    Pivots = []
+    while file.tell() < chunkEnd:
+        chunkType = ReadLong(file)
+        chunkSize = GetChunkSize(ReadLong(file))
+        subChunkEnd = file.tell() + chunkSize
+        if chunkType == 257:
+            HierarchyHeader = ReadHierarchyHeader(file)
+            #print("Header")
+        elif chunkType == 258:
+            Pivots = ReadPivots(file, subChunkEnd)
+            #print("Pivots")
+        else:
+            self.report({'ERROR'}, "unknown chunktype in Hierarchy: %s" % chunkType)
+            print("!!!unknown chunktype in Hierarchy: %s" % chunkType)
+            file.seek(chunkSize, 1)
+    return struct_w4d.Hierarchy(header = HierarchyHeader, pivots = Pivots)
+
+#######################################################################################
+# Animation
+#######################################################################################
+
+def ReadAnimationHeader(file):
+    return struct_w4d.AnimationHeader(name = ReadString(file), hieraName = ReadString(file), numFrames = ReadLong(file), frameRate = ReadLong(file))
+
+# key layouts of chunk 514 by vectorLen (2 byte frame + the value)
+TimeCodedKeyTypes = {
+    1: np.dtype([("frame", "<u2"), ("value", "<f4")]),
+    4: np.dtype([("frame", "<u2"), ("value", "<f4", (4,))]),
+    quantize_w4d.SMALLEST_THREE: np.dtype([("frame", "<u2"), ("value", "<u2", (3,))])}
+
+def ReadTimeCodedAnimationChannel(file, self, chunkEnd):
+    VectorLen = ReadShort(file)
+    Type = ReadShort(file)
+    Pivot = ReadShort(file)
+    if VectorLen in TimeCodedKeyTypes:
+        keys = ReadRecords(file, chunkEnd, TimeCodedKeyTypes[VectorLen])
+        Frames = keys["frame"]
+        Values = keys["value"]
+        if VectorLen == 4:
+            #change order from xyzw to wxyz
+            Values = Values[:, [3, 0, 1, 2]]
+        elif VectorLen == quantize_w4d.SMALLEST_THREE:
+            #packed in wxyz order already
+            Values = quantize_w4d.UnpackQuaternions(Values)
+            VectorLen = 4
+    else:
+        self.report({'ERROR'}, "!!!unsupported vector len %s" % VectorLen)
+        print("!!!unsupported vector len %s" % VectorLen)
+        file.seek(chunkEnd, 0)
+        Frames = np.empty(0, dtype = np.uint16)
+        Values = np.empty(0, dtype = np.float32)
+    return struct_w4d.TimeCodedAnimationChannel(vectorLen = VectorLen, type = Type, pivot = Pivot, frames = Frames, values = Values)
+
+def ReadAnimation(file, self, chunkEnd):
+    print("\n### NEW ANIMATION: ###")
+    Header = struct_w4d.AnimationHeader()
+    Channels = []
+    while file.tell() < chunkEnd:
+        chunkType = ReadLong(file)
+        chunkSize = GetChunkSize(ReadLong(file))
+        subChunkEnd = file.tell() + chunkSize
+        if chunkType == 513:
+            Header = ReadAnimationHeader(file)
+        elif chunkType == 514:
+            Channels.append(ReadTimeCodedAnimationChannel(file, self, subChunkEnd))
+        else:
+            self.report({'ERROR'}, "unknown chunktype in Animation: %s" % chunkType)
+            print("!!!unknown chunktype in Animation: %s" % chunkType)
+            file.seek(chunkSize, 1)
+    return struct_w4d.Animation(header = Header, channels = Channels)
+	
+#######################################################################################
+# Model
+#######################################################################################
+
+def ReadModel(file):
+    print("\n### MODEL: ###")
+    model = struct_w4d.Model()
+    model.name = ReadString(file)
+    model.hieraName = ReadString(file)
+    print(model.name)
+    print(model.hieraName)
+    return model
+
+#######################################################################################
+# Box
+#######################################################################################	
+
+def ReadBox(file):
+    #print("\n### NEW BOX: ###")
+    center = ReadVector(file)
+    extend = ReadVector(file)
+    return struct_w4d.Box(center = center, extend = extend)
+
+#######################################################################################
+# Vertices
+#######################################################################################
+
+def ReadMeshVerticesArray(file, chunkEnd):
+    #float32 Nx3, decoded in one go
+    return ReadArray(file, chunkEnd, "<f4", 3)
+
+def ReadMeshQuantizedVertices(file, chunkEnd, header):
+    #uint16 Nx3 inside the bounding box of the header
+    return quantize_w4d.DequantizePositions(ReadArray(file, chunkEnd, "<u2", 3), header.minCorner, header.maxCorner)
+
+def ReadMeshOctahedralNormals(file, chunkEnd):
+    #int16 Nx2
+    return quantize_w4d.DecodeOctahedral(ReadArray(file, chunkEnd, "<i2", 2))
+
+#######################################################################################
+# Faces
+#######################################################################################	
+
+def ReadMeshFaces(file, chunkEnd):
+    #uint32 Nx3
+    return ReadArray(file, chunkEnd, "<u4", 3)
+
+def ReadMeshShortFaces(file, chunkEnd):
+    #uint16 Nx3
+    return ReadArray(file, chunkEnd, "<u2", 3).astype(np.uint32)
+	
+#######################################################################################
+# UVCoords
+#######################################################################################	
+
+def ReadMeshUVCoords(file, chunkEnd):
+    #float32 Nx2
+    return ReadArray(file, chunkEnd, "<f4", 2)
+
+def ReadMeshHalfUVCoords(file, chunkEnd):
+    #float16 Nx2
+    return quantize_w4d.DecodeHalf(ReadArray(file, chunkEnd, "<f2", 2))
+	
+#######################################################################################
+# VertexInfluences
+#######################################################################################	
+	
+def ReadMeshVertexInfluences(file, chunkEnd):
+    vertInfs = []
+    while file.tell()  < chunkEnd:
+        vertInf = struct_w4d.MeshVertexInfluences()
+        vertInf.boneIdx = ReadShort(file)
+        vertInf.boneInf = ReadShort(file)/100
+        vertInfs.append(vertInf)
+    return vertInfs
+
+# chunk 8 holds the second influence of each vertex in chunk 7, returns (N, 2) uint16 records
+def ReadMeshExtraVertexInfluences(file, chunkEnd):
+    return ReadArray(file, chunkEnd, "<u2", 2)
+
+def MergeExtraVertexInfluences(vertInfs, extraInfs):
+    if len(extraInfs) != len(vertInfs):
+        print("!!!%i extra vertex influences for %i vertex influences" % (len(extraInfs), len(vertInfs)))
+    for vertInf, (xtraIdx, xtraInf) in zip(vertInfs, extraInfs.tolist()):
+        vertInf.xtraIdx = xtraIdx
+        vertInf.xtraInf = xtraInf/100
+    return vertInfs
+	
+#######################################################################################
+# Texture
+#######################################################################################	
+
+def ReadTexture(file):
+    #print("Texture")
+    tex = struct_w4d.Texture()
+    tex.name = ReadString(file)
+    tex.type = ReadUnsignedByte(file)
+    tex.value = ReadFloat(file)
+	
+    # read texture animations
+    return tex
+
+#######################################################################################
+# Material
+#######################################################################################	
+
+def ReadMeshMaterial(file, chunkEnd):
+    mat = struct_w4d.MeshMaterial()
+    mat.diffuse = ReadRGBA(file)
+    mat.diffuse_intensity = ReadFloat(file)
+    mat.specular = ReadRGBA(file)
+    mat.specular_intensity = ReadFloat(file)
+    mat.emit = ReadFloat(file)
+    mat.alpha = ReadFloat(file)
+    mat.textures = []
+	
+    while file.tell() < chunkEnd:
+        Chunktype = ReadLong(file)
+        Chunksize = GetChunkSize(ReadLong(file))
+        subChunkEnd = file.tell() + Chunksize
+		
+        if Chunktype == 31:
+            mat.textures.append(ReadTexture(file))
+        else:
+            self.report({'ERROR'}, "unknown chunktype in MeshMaterial: %s" % Chunktype)
+            print("!!!unknown chunktype in MeshMaterial: %s" % Chunktype)
+            file.seek(Chunksize,1)
+    return mat
+
+#######################################################################################
+# Mesh
+#######################################################################################	
+
+def ReadMeshHeader(file):
+    result = struct_w4d.MeshHeader(type =  ReadUnsignedByte(file), meshName = ReadString(file), 
+		parentPivot = ReadShort(file), faceCount = ReadLong(file), vertCount = ReadLong(file), 
+		#bounding volumes
+		minCorner = ReadVector(file),
+		maxCorner = ReadVector(file),
+		sphCenter = ReadVector(file),
+		sphRadius =  ReadFloat(file))
+    return result
+
+def ReadMesh(self, file, chunkEnd):
+    MeshHeader = struct_w4d.MeshHeader()
+    MeshVerticesInfs = []
+    MeshExtraInfs = None
+    MeshVertices = np.empty((0, 3), dtype = np.float32)
+    MeshNormals = np.empty((0, 3), dtype = np.float32)
+    MeshFaces = np.empty((0, 3), dtype = np.uint32)
+    MeshUVCoords = np.empty((0, 2), dtype = np.float32)
+    MeshMaterials = []
+
+    #print("\n### NEW MESH: ###")
+    while file.tell() < chunkEnd:
+        Chunktype = ReadLong(file)
+        Chunksize = GetChunkSize(ReadLong(file))
+        subChunkEnd = file.tell() + Chunksize
+
+        if Chunktype == 2:
+            try:
+                MeshHeader = ReadMeshHeader(file)
+                print("## MeshName: " + MeshHeader.meshName)
+                #print("Header")               
+            except:
+                self.report({'ERROR'}, "Mistake while reading Mesh Header (Mesh) Byte:%s" % file.tell())
+                print("Mistake while reading Mesh Header (Mesh) Byte:%s" % file.tell())
+                e = sys.exc_info()[1]
+                print(e)
+        elif Chunktype == 3:
+            try:
+                MeshVertices = ReadMeshVerticesArray(file, subChunkEnd)
+                #print("Vertices")
+            except:
+                self.report({'ERROR'}, "Mistake while reading Vertices (Mesh) Byte:%s" % file.tell())
+                print("Mistake while reading Vertices (Mesh) Byte:%s" % file.tell())
+                e = sys.exc_info()[1]
+                print(e)
+        elif Chunktype == 4:
+            try:
+                MeshNormals = ReadMeshVerticesArray(file, subChunkEnd)
+                #print("Normals")
+            except:
+                self.report({'ERROR'}, "Mistake while reading Normals (Mesh) Byte:%s" % file.tell())
+                print("Mistake while reading Normals (Mesh) Byte:%s" % file.tell())
+                e = sys.exc_info()[1]
+                print(e)
+        elif Chunktype == 5:
+            try:
+                MeshFaces = ReadMeshFaces(file, subChunkEnd)
+                #print("Faces")
+            except:
+                self.report({'ERROR'}, "Mistake while reading Mesh Faces (Mesh) Byte:%s" % file.tell())
+                print("Mistake while reading Mesh Faces (Mesh) Byte:%s" % file.tell())
+                e = sys.exc_info()[1]
+                print(e)
+        elif Chunktype == 6:
+            try:
+                MeshUVCoords = ReadMeshUVCoords(file, subChunkEnd)
+                #print("UVCoords")
+            except:
+                self.report({'ERROR'}, "Mistake while reading Mesh UVCoords (Mesh) Byte:%s" % file.tell())
+                print("Mistake while reading Mesh UVCoords (Mesh) Byte:%s" % file.tell())
+                e = sys.exc_info()[1]
+                print(e)
+        elif Chunktype == 7:
+            try:
+                MeshVerticesInfs = ReadMeshVertexInfluences(file, subChunkEnd)
+                #print("VertInfs")
+            except:
+                self.report({'ERROR'}, "Mistake while reading Usertext (Mesh) Byte:%s" % file.tell())
+                print("Mistake while reading Usertext (Mesh) Byte:%s" % file.tell())
+                e = sys.exc_info()[1]
+                print(e)
+        elif Chunktype == 8:
+            try:
+                MeshExtraInfs = ReadMeshExtraVertexInfluences(file, subChunkEnd)
+                #print("ExtraVertInfs")
+            except:
+                self.report({'ERROR'}, "Mistake while reading Extra Vertex Influences (Mesh) Byte:%s" % file.tell())
+                print("Mistake while reading Extra Vertex Influences (Mesh) Byte:%s" % file.tell())
+                e = sys.exc_info()[1]
+                print(e)
+        elif Chunktype == 9:
+            try:
+                MeshVertices = ReadMeshQuantizedVertices(file, subChunkEnd, MeshHeader)
+            except:
+                self.report({'ERROR'}, "Mistake while reading Quantized Vertices (Mesh) Byte:%s" % file.tell())
+                print("Mistake while reading Quantized Vertices (Mesh) Byte:%s" % file.tell())
+                e = sys.exc_info()[1]
+                print(e)
+        elif Chunktype == 10:
+            try:
+                MeshNormals = ReadMeshOctahedralNormals(file, subChunkEnd)
+            except:
+                self.report({'ERROR'}, "Mistake while reading Octahedral Normals (Mesh) Byte:%s" % file.tell())
+                print("Mistake while reading Octahedral Normals (Mesh) Byte:%s" % file.tell())
+                e = sys.exc_info()[1]
+                print(e)
+        elif Chunktype == 11:
+            try:
+                MeshUVCoords = ReadMeshHalfUVCoords(file, subChunkEnd)
+            except:
+                self.report({'ERROR'}, "Mistake while reading Half Mesh UVCoords (Mesh) Byte:%s" % file.tell())
+                print("Mistake while reading Half Mesh UVCoords (Mesh) Byte:%s" % file.tell())
+                e = sys.exc_info()[1]
+                print(e)
+        elif Chunktype == 12:
+            try:
+                MeshFaces = ReadMeshShortFaces(file, subChunkEnd)
+            except:
+                self.report({'ERROR'}, "Mistake while reading Short Mesh Faces (Mesh) Byte:%s" % file.tell())
+                print("Mistake while reading Short Mesh Faces (Mesh) Byte:%s" % file.tell())
+                e = sys.exc_info()[1]
+                print(e)
+        elif Chunktype == 30:
+            try:
+                MeshMaterials.append(ReadMeshMaterial(file, subChunkEnd))
+                #print("Material")
+            except:
+                self.report({'ERROR'}, "Mistake while reading Mesh Material (Mesh) Byte:%s" % file.tell())
+                print("Mistake while reading Mesh Material (Mesh) Byte:%s" % file.tell())
+                e = sys.exc_info()[1]
+                print(e)				
+        else:
+            self.report({'ERROR'}, "unknown chunktype in Mesh: %s" % Chunktype)
+            print("!!!unknown chunktype in Mesh: %s" % Chunktype)
+            file.seek(Chunksize,1)
+    if MeshExtraInfs is not None:
+        MergeExtraVertexInfluences(MeshVerticesInfs, MeshExtraInfs)
+    return struct_w4d.Mesh(header = MeshHeader, verts = MeshVertices, normals = MeshNormals, faces = MeshFaces, 
+		uvCoords = MeshUVCoords, vertInfs = MeshVerticesInfs, materials = MeshMaterials)
+
+#######################################################################################
+# Lazy Mesh
+#######################################################################################
+
+# attribute -> (chunktype, reader, empty value)
+LazyMeshChunks = {
+    "verts": (3, ReadMeshVerticesArray, lambda: np.empty((0, 3), dtype = np.float32)),
+    "normals": (4, ReadMeshVerticesArray, lambda: np.empty((0, 3), dtype = np.float32)),
+    "faces": (5, ReadMeshFaces, lambda: np.empty((0, 3), dtype = np.uint32)),
+    "uvCoords": (6, ReadMeshUVCoords, lambda: np.empty((0, 2), dtype = np.float32)),
+    "vertInfs": (7, ReadMeshVertexInfluences, list),
+    "materials": (30, ReadMeshMaterial, list)}
+
+# compact chunktype -> (chunktype it replaces, reader(file, chunkEnd, header))
+CompactMeshChunks = {
+    9: (3, ReadMeshQuantizedVertices),
+    10: (4, lambda file, chunkEnd, header: ReadMeshOctahedralNormals(file, chunkEnd)),
+    11: (6, lambda file, chunkEnd, header: ReadMeshHalfUVCoords(file, chunkEnd)),
+    12: (5, lambda file, chunkEnd, header: ReadMeshShortFaces(file, chunkEnd))}
+
+# the file has to stay open as long as attributes of the mesh may still be decoded
+def ReadLazyMesh(self, file, chunkEnd):
+    MeshHeader = struct_w4d.MeshHeader()
+    chunks = {}
+    while file.tell() < chunkEnd:
+        Chunktype = ReadLong(file)
+        Chunksize = GetChunkSize(ReadLong(file))
+        subChunkEnd = file.tell() + Chunksize
+
+        if Chunktype == 2:
+            MeshHeader = ReadMeshHeader(file)
+        elif Chunktype in (3, 4, 5, 6, 7, 8, 30):
+            chunks.setdefault(Chunktype, []).append((file.tell(), subChunkEnd, None))
+        elif Chunktype in CompactMeshChunks:
+            # filed under the chunktype it replaces, with its own reader
+            replaced, reader = CompactMeshChunks[Chunktype]
+            chunks.setdefault(replaced, []).append((file.tell(), subChunkEnd, reader))
+        else:
+            self.report({'ERROR'}, "unknown chunktype in Mesh: %s" % Chunktype)
+            print("!!!unknown chunktype in Mesh: %s" % Chunktype)
+        file.seek(subChunkEnd, 0)
+
+    def decode(name):
+        chunkType, reader, empty = LazyMeshChunks[name]
+        ranges = chunks.get(chunkType, [])
+        pos = file.tell()
+        try:
+            if chunkType == 30:
+                materials = []
+                for start, end, compact in ranges:
+                    file.seek(start, 0)
+                    materials.append(reader(file, end))
+                return materials
+            if len(ranges) == 0:
+                return empty()
+            # like ReadMesh the last chunk of a type wins
+            start, end, compact = ranges[-1]
+            file.seek(start, 0)
+            if compact is not None:
+                return compact(file, end, MeshHeader)
+            value = reader(file, end)
+            if chunkType == 7 and 8 in chunks:
+                start, end, compact = chunks[8][-1]
+                file.seek(start, 0)
+                MergeExtraVertexInfluences(value, ReadMeshExtraVertexInfluences(file, end))
+            return value
+        finally:
+            file.seek(pos, 0)
+
+    return struct_w4d.LazyMesh(header = MeshHeader, decode = decode)
+
+#######################################################################################
+# loadSkeleton 
+#######################################################################################
+
+def ReadSKL(self, sklpath, mapped = True):
+    #print("\n### SKELETON: ###")
+    Hierarchy = struct_w4d.Hierarchy()
+    file = OpenFile(sklpath, mapped)
+    filesize = GetFileSize(file)
+
+    while file.tell() < filesize:
+        chunkType = ReadLong(file)
+        Chunksize =  GetChunkSize(ReadLong(file))
+        chunkEnd = file.tell() + Chunksize
+        if chunkType == 256:
+            Hierarchy = ReadHierarchy(file, self, chunkEnd)
+        else:
+            file.seek(Chunksize, 1)
+    file.close()
+    return Hierarchy
+
+# parsed skeletons by resolved path, an entry is only used while the mtime and size of the file match.
+# the hierarchies are shared between all imports, so they must not be modified
+class HierarchyCache:
+    def __init__(self, maxSize = 16):
+        self.maxSize = maxSize
+        self.entries = collections.OrderedDict()
+
+    def Stamp(self, path):
+        path = os.path.realpath(path)
+        stat = os.stat(path)
+        return path, (stat.st_mtime_ns, stat.st_size)
+
+    def Get(self, operator, sklpath, mapped = True):
+        path, stamp = self.Stamp(sklpath)
+        entry = self.entries.get(path)
+        if entry is not None and entry[0] == stamp:
+            self.entries.move_to_end(path)
+            return entry[1]
+        hierarchy = ReadSKL(operator, path, mapped)
+        self.Put(path, hierarchy, stamp)
+        return hierarchy
+
+    def Put(self, sklpath, hierarchy, stamp = None):
+        path = os.path.realpath(sklpath)
+        if stamp is None:
+            path, stamp = self.Stamp(path)
+        self.entries[path] = (stamp, hierarchy)
+        self.entries.move_to_end(path)
+        while len(self.entries) > self.maxSize:
+            self.entries.popitem(last = False)
+
+    # drops the entry of the file or all entries
+    def Invalidate(self, sklpath = None):
+        if sklpath is None:
+            self.entries.clear()
+        else:
+            self.entries.pop(os.path.realpath(sklpath), None)
+
+SkeletonCache = HierarchyCache()
+
+def LoadSKL(self, sklpath, mapped = True):
+    return SkeletonCache.Get(self, sklpath, mapped)
+
+#######################################################################################
+# Table of Contents
+#######################################################################################
+
+# chunks that only contain other chunks (plus the fixed material values)
+ContainerChunks = {1: 0, 30: 24, 256: 0, 512: 0}
+
+# header chunks of the mesh, hierarchy and animation containers
+HeaderChunks = (2, 257, 513)
+
+# element size of the array chunks, to get the counts without reading them
+ArrayChunks = {3: ("vertCount", 12), 4: ("normalCount", 12), 5: ("faceCount", 12), 6: ("uvCount", 8), 7: ("infCount", 4), 8: ("xtraInfCount", 4),
+    9: ("vertCount", 6), 10: ("normalCount", 4), 11: ("uvCount", 4), 12: ("faceCount", 6)}
+
+def ScanHeaderFields(file, chunkType, chunkSize):
+    if chunkType == 0:
+        return {"name": ReadString(file), "hieraName": ReadString(file)}
+    elif chunkType == 2:
+        return {"type": ReadUnsignedByte(file), "meshName": ReadString(file), "parentPivot": ReadShort(file),
+            "faceCount": ReadLong(file), "vertCount": ReadLong(file)}
+    elif chunkType == 31:
+        return {"name": ReadString(file)}
+    elif chunkType == 257:
+        return {"name": ReadString(file), "pivotCount": ReadLong(file)}
+    elif chunkType == 513:
+        return {"name": ReadString(file), "hieraName": ReadString(file), "numFrames": ReadLong(file), "frameRate": ReadLong(file)}
+    elif chunkType == 514:
+        fields = {"vectorLen": ReadShort(file), "type": ReadShort(file), "pivot": ReadShort(file)}
+        if fields["vectorLen"] in TimeCodedKeyTypes:
+            fields["keyCount"] = (chunkSize - 6) // TimeCodedKeyTypes[fields["vectorLen"]].itemsize
+        return fields
+    elif chunkType in ArrayChunks:
+        name, elementSize = ArrayChunks[chunkType]
+        return {name: chunkSize // elementSize}
+    return {}
+
+def ScanChunks(file, chunkEnd):
+    chunks = []
+    while file.tell() + 8 <= chunkEnd:
+        offset = file.tell()
+        chunkType = ReadLong(file)
+        chunkSize = GetChunkSize(ReadLong(file))
+        subChunkEnd = file.tell() + chunkSize
+        if subChunkEnd > chunkEnd:
+            print("!!!chunk %s at byte %s exceeds its parent" % (chunkType, offset))
+            subChunkEnd = chunkEnd
+        info = struct_w4d.ChunkInfo(type = chunkType, offset = offset, size = chunkSize, fields = {}, children = [])
+        if chunkType in ContainerChunks:
+            file.seek(ContainerChunks[chunkType], 1)
+            info.children = ScanChunks(file, subChunkEnd)
+            for child in info.children:
+                # lift the header values (mesh name, counts, ...) onto the container
+                if child.type in HeaderChunks:
+                    info.fields.update(child.fields)
+        else:
+            info.fields = ScanHeaderFields(file, chunkType, chunkSize)
+        file.seek(subChunkEnd, 0)
+        chunks.append(info)
+    return chunks
+
+# builds a nested index of all chunks in the file without decoding any payload
+def ScanFile(path, mapped = True):
+    file = OpenFile(path, mapped)
+    try:
+        return ScanChunks(file, GetFileSize(file))
+    finally:
+        file.close()
+
+#######################################################################################
+# Chunk Iterator
+#######################################################################################
+
+# stands in for the blender operator when reading without blender (the readers print the errors anyway)
+class ConsoleReport:
+    def report(self, type, message):
+        pass
+
+# decoders of the top level chunks
+ChunkDecoders = {
+    0: lambda self, file, chunkEnd: ReadModel(file),
+    1: lambda self, file, chunkEnd: ReadMesh(self, file, chunkEnd),
+    256: lambda self, file, chunkEnd: ReadHierarchy(file, self, chunkEnd),
+    512: lambda self, file, chunkEnd: ReadAnimation(file, self, chunkEnd),
+    1024: lambda self, file, chunkEnd: ReadBox(file)}
+
+# gives access to the payload of a chunk yielded by IterChunks
+class ChunkReader:
+    def __init__(self, file, operator, chunkType, start, end):
+        self.file = file
+        self.operator = operator
+        self.type = chunkType
+        self.start = start
+        self.end = end
+        self.decoded = None
+
+    # the raw payload (a memoryview if the file is mapped)
+    def Data(self):
+        self.file.seek(self.start, 0)
+        return ReadChunkData(self.file, self.end)
+
+    # the struct of the chunk, None for unknown chunk types
+    def Decode(self):
+        if self.decoded is None and self.type in ChunkDecoders:
+            self.file.seek(self.start, 0)
+            self.decoded = ChunkDecoders[self.type](self.operator, self.file, self.end)
+        return self.decoded
+
+    def Release(self):
+        self.decoded = None
+
+# yields (chunkType, ChunkInfo, ChunkReader) for every top level chunk in file order.
+# with decodeMeshes each mesh is decoded when it is reached and dropped when the loop moves on
+def IterChunks(file, self = None, decodeMeshes = False, chunkEnd = None):
+    if self is None:
+        self = ConsoleReport()
+    if chunkEnd is None:
+        chunkEnd = GetFileSize(file)
+    while file.tell() + 8 <= chunkEnd:
+        offset = file.tell()
+        chunkType = ReadLong(file)
+        chunkSize = GetChunkSize(ReadLong(file))
+        start = file.tell()
+        end = min(start + chunkSize, chunkEnd)
+        header = struct_w4d.ChunkInfo(type = chunkType, offset = offset, size = chunkSize, fields = {}, children = [])
+        payload = ChunkReader(file, self, chunkType, start, end)
+        if decodeMeshes and chunkType == 1:
+            payload.Decode()
+        yield chunkType, header, payload
+        payload.Release()
+        file.seek(end, 0)
+
+def IterFile(path, self = None, decodeMeshes = False, mapped = True):
+    file = OpenFile(path, mapped)
+    try:
+        for record in IterChunks(file, self, decodeMeshes):
+            yield record
+    finally:
+        file.close()
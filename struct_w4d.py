@@ -1,7 +1,11 @@
 #Written by Michael Schnabel
 #Last Modification 19.10.2015
 #Structs of the W4D Format 
-from mathutils import Vector, Quaternion
+try:
+    from mathutils import Vector, Quaternion
+except ImportError:
+    # outside of blender (batch import workers, command line tools) these are plain tuples
+    Vector = Quaternion = tuple
 
 class Struct:
     def __init__ (self, *argv, **argd):
@@ -23,6 +27,14 @@ class RGBA(Struct):
     g = 0
     b = 0
     a = 0
+
+# entry of the chunk index built by reader_w4d.ScanFile (not stored in the file)
+class ChunkInfo(Struct):
+    type = 0
+    offset = 0 # position of the 8 byte chunk head
+    size = 0 # size of the payload
+    fields = {} # cheap header values (names, counts)
+    children = []
 	
 #######################################################################################
 # Hierarchy
@@ -47,9 +59,83 @@ class HierarchyFile(Struct):
     name = ""
 
 # chunk 256
+# keeps a name -> index map and the tree of the pivots, pivots have to be added with AddPivot
+# (or Reindex has to be called after the pivots list was changed). a pivot may reference a parent
+# that is added later, the tree is rebuilt when that parent arrives
 class Hierarchy(Struct):
     header = HierarchyHeader()
     pivots = []
+
+    def __init__ (self, *argv, **argd):
+        self.header = HierarchyHeader()
+        self.pivots = []
+        Struct.__init__(self, *argv, **argd)
+        self.Reindex()
+
+    def Reindex(self):
+        self.index = {} # name -> index of the first pivot with that name
+        self.parents = [] # index of the parent pivot or -1
+        self.children = [] # indices of the child pivots
+        for i, pivot in enumerate(self.pivots):
+            self.index.setdefault(pivot.name, i)
+            self.parents.append(self.ParentIndex(i))
+            self.children.append([])
+        for i, parent in enumerate(self.parents):
+            if parent >= 0:
+                self.children[parent].append(i)
+        # parent indices that do not exist yet
+        self.missing = set(pivot.parentID for pivot in self.pivots if pivot.parentID >= len(self.pivots))
+
+        # walk the tree from the roots down to get the depths and the topological order
+        self.depths = [-1] * len(self.pivots) # 0 for root pivots
+        self.order = [] # parents before their children
+        level = [i for i, parent in enumerate(self.parents) if parent < 0]
+        depth = 0
+        while len(level) > 0:
+            for i in level:
+                self.depths[i] = depth
+            self.order.extend(level)
+            level = [child for i in level for child in self.children[i]]
+            depth += 1
+        # pivots in a parent loop are not reachable from a root
+        self.order.extend(i for i, d in enumerate(self.depths) if d < 0)
+
+    def ParentIndex(self, i):
+        parent = self.pivots[i].parentID
+        if 0 <= parent < len(self.pivots) and parent != i:
+            return parent
+        return -1
+
+    def AddPivot(self, pivot):
+        self.pivots.append(pivot)
+        i = len(self.pivots) - 1
+        if i in self.missing:
+            # earlier pivots are children of this one
+            self.Reindex()
+            return i
+        if pivot.parentID > i:
+            self.missing.add(pivot.parentID)
+        self.index.setdefault(pivot.name, i)
+        parent = self.ParentIndex(i)
+        self.parents.append(parent)
+        self.children.append([])
+        if parent >= 0:
+            self.children[parent].append(i)
+            self.depths.append(self.depths[parent] + 1 if self.depths[parent] >= 0 else -1)
+        else:
+            self.depths.append(0)
+        self.order.append(i)
+        return i
+
+    # index of the pivot or -1
+    def FindPivot(self, name):
+        return self.index.get(name, -1)
+
+    def GetPivot(self, name):
+        i = self.index.get(name, -1)
+        if i < 0:
+            return None
+        return self.pivots[i]
 	
 #######################################################################################
 # Animation
@@ -62,16 +148,13 @@ class AnimationHeader(Struct):
     numFrames = 0
     frameRate = 0
 	
-class TimeCodedAnimationKey(Struct):
-    frame = 0
-    value = 0
-	
 #chunk 514
 class TimeCodedAnimationChannel(Struct):
     vectorLen = 0
     type = 0
     pivot = 0 
-    timeCodedKeys = []
+    frames = [] # uint16 N
+    values = [] # float32 N (vectorLen 1) or Nx4 quaternions in wxyz order (vectorLen 4)
 	
 #chunk 512
 class Animation(Struct):
@@ -100,10 +183,12 @@ class Box(Struct):
 # VertexInfluences
 #######################################################################################
 
-#chunk 7
+#chunk 7 (xtraIdx and xtraInf are stored in chunk 8)
 class MeshVertexInfluences(Struct):
     boneIdx = 0
     boneInf = 0.0
+    xtraIdx = 0
+    xtraInf = 0.0
 	
 #######################################################################################
 #  Texture Animation
@@ -163,9 +248,57 @@ class MeshHeader(Struct):
 #chunk 1
 class Mesh(Struct):
     header = MeshHeader()
-    verts = []
-    normals = []
-    faces = []
-    uvCoords = []	
+    verts = [] # float32 Nx3 array when read from file (chunk 3, or 9 quantized)
+    normals = [] # float32 Nx3 (chunk 4, or 10 octahedral)
+    faces = [] # uint32 Nx3 (chunk 5, or 12 uint16)
+    uvCoords = [] # float32 Nx2 (chunk 6, or 11 float16)
     vertInfs = []
-    materials = []
\ No newline at end of file
+    materials = []
+
+# returns a property that asks the mesh for the value on first access and keeps it
+def LazyAttribute(name):
+    def get(self):
+        if not name in self.cache:
+            self.cache[name] = self.decode(name)
+        return self.cache[name]
+    def set(self, value):
+        self.cache[name] = value
+    return property(get, set)
+
+# chunk 1 read by reader_w4d.ReadLazyMesh, only the header is decoded up front
+class LazyMesh(Mesh):
+    def __init__ (self, *argv, **argd):
+        self.cache = {}
+        Struct.__init__(self, *argv, **argd)
+
+    def decode(self, name):
+        return getattr(Mesh, name)
+
+    verts = LazyAttribute("verts")
+    normals = LazyAttribute("normals")
+    faces = LazyAttribute("faces")
+    uvCoords = LazyAttribute("uvCoords")
+    vertInfs = LazyAttribute("vertInfs")
+    materials = LazyAttribute("materials")
+
+#######################################################################################
+# File
+#######################################################################################
+
+# all chunks of a parsed file (used by the batch loader, not stored in the file)
+class W4DFile(Struct):
+    path = ""
+    model = None
+    meshes = []
+    hierarchy = None
+    animation = None
+    box = None
+    blocks = [] # shared memory blocks the mesh arrays live in
+    error = None # message if the file could not be read
+
+# array in a shared memory block, stands in for a mesh array on its way from a batch worker
+class SharedArray(Struct):
+    block = ""
+    offset = 0
+    dtype = ""
+    shape = ()
@@ -0,0 +1,421 @@
+#Written by Michael Schnabel
+#Last Modification 21.10.2015
+#Writes the structs of struct_w4d in the W4D Format (does not need blender)
+import struct
+from contextlib import contextmanager
+import numpy as np
+from . import struct_w4d, quantize_w4d
+
+HEAD = 8 #4(long = chunktype) + 4 (long = chunksize)
+
+#######################################################################################
+# Chunk Buffer
+#######################################################################################
+
+LONG = struct.Struct("<L")
+SIGNED_LONG = struct.Struct("<l")
+SHORT = struct.Struct("<H")
+SIGNED_SHORT = struct.Struct("<h")
+FLOAT = struct.Struct("<f")
+SIGNED_BYTE = struct.Struct("<b")
+UNSIGNED_BYTE = struct.Struct("<B")
+VECTOR = struct.Struct("<3f")
+QUATERNION = struct.Struct("<4f")
+RGBA = struct.Struct("<4B")
+
+# a top level chunk is assembled in here and written to the file with a single write.
+# chunks are opened with a placeholder size which is patched when they are closed,
+# so the data is only walked once and the sizes always match what was written
+class ChunkBuffer:
+    def __init__(self, size = 4096):
+        self.data = bytearray(size)
+        self.pos = 0
+        self.chunks = [] # (position of the size, container) of the open chunks
+
+    def reserve(self, size):
+        if self.pos + size > len(self.data):
+            self.data.extend(bytes(max(self.pos + size - len(self.data), len(self.data))))
+
+    def pack(self, format, *values):
+        self.reserve(format.size)
+        format.pack_into(self.data, self.pos, *values)
+        self.pos += format.size
+
+    def write(self, data):
+        size = len(data)
+        self.reserve(size)
+        self.data[self.pos:self.pos + size] = data
+        self.pos += size
+
+    def tell(self):
+        return self.pos
+
+    def BeginChunk(self, chunkType, container = False):
+        self.pack(LONG, chunkType)
+        self.chunks.append((self.pos, container))
+        self.pack(LONG, 0) #chunksize, patched by EndChunk
+
+    def EndChunk(self):
+        sizePos, container = self.chunks.pop()
+        size = self.pos - sizePos - 4
+        if container:
+            size = MakeChunkSize(size)
+        LONG.pack_into(self.data, sizePos, size)
+
+    # with buffer.Chunk(type): ... writes the chunk header around the block
+    @contextmanager
+    def Chunk(self, chunkType, container = False):
+        self.BeginChunk(chunkType, container)
+        yield self
+        self.EndChunk()
+
+    def getvalue(self):
+        return memoryview(self.data)[:self.pos]
+
+    def WriteTo(self, file):
+        if len(self.chunks) > 0:
+            raise ValueError("%i chunks are still open" % len(self.chunks))
+        file.write(self.getvalue())
+        self.pos = 0
+
+#######################################################################################
+# Basic Methods
+#######################################################################################
+
+def getStringSize(string):
+    return len(bytes(string, 'UTF-8')) + 1 #binary 0
+
+def WriteString(file, string):
+    file.write(bytes(string, 'UTF-8'))
+	#write binary 0 to file
+    file.pack(UNSIGNED_BYTE, 0)
+		
+def WriteRGBA(file, rgba):
+    file.pack(RGBA, rgba.r, rgba.g, rgba.b, rgba.a)
+	
+# only if the chunk has subchunks -> else: WriteLong(file, data)
+def MakeChunkSize(data):
+    return (data | 0x80000000)
+
+def WriteLong(file, num):
+    file.pack(LONG, num)
+
+def WriteSignedLong(file, num):
+    file.pack(SIGNED_LONG, num)
+	
+def WriteShort(file, num):
+    file.pack(SHORT, num)
+
+def WriteSignedShort(file, num):
+    file.pack(SIGNED_SHORT, num)
+	
+def WriteLongArray(file, array):
+    for a in array:
+        WriteLong(file, a)
+
+def WriteFloat(file, num):
+    file.pack(FLOAT, num)
+	
+def WriteSignedByte(file, num):
+    file.pack(SIGNED_BYTE, num)
+
+def WriteUnsignedByte(file, num):
+    file.pack(UNSIGNED_BYTE, num)
+	
+def WriteVector(file, vec):
+    file.pack(VECTOR, vec[0], vec[1], vec[2])
+	
+def WriteQuaternion(file, quat):
+    #changes the order from wxyz to xyzw
+    file.pack(QUATERNION, quat[1], quat[2], quat[3], quat[0])
+
+# contiguous (N, width) array in the byte order of the file, arrays that already are stay as they are
+def ToArray(values, dtype, width):
+    if len(values) == 0:
+        return np.empty((0, width), dtype = dtype)
+    return np.ascontiguousarray(values, dtype = dtype).reshape(-1, width)
+
+# writes the array with a single copy into the buffer
+def WriteArray(file, array):
+    if array.nbytes > 0:
+        file.write(memoryview(array).cast("B"))
+	
+#######################################################################################
+# Hierarchy
+#######################################################################################
+
+def WriteHierarchyHeader(file, header):
+    with file.Chunk(257):
+        WriteString(file, header.name)
+        WriteLong(file, header.pivotCount)
+        WriteVector(file, header.centerPos)
+
+def WritePivots(file, pivots):
+    with file.Chunk(258):
+        for pivot in pivots:
+            WriteString(file, pivot.name)
+            WriteSignedShort(file, pivot.parentID)
+            WriteUnsignedByte(file, pivot.isBone)
+            WriteVector(file, pivot.position)
+            WriteQuaternion(file, pivot.rotation)
+
+def WriteHierarchy(file, hierarchy):
+    print("\n### NEW HIERARCHY: ###")
+    buffer = ChunkBuffer()
+    with buffer.Chunk(256, container = True):
+        WriteHierarchyHeader(buffer, hierarchy.header)
+        print("Header")
+        WritePivots(buffer, hierarchy.pivots)
+        print("Pivots")
+    buffer.WriteTo(file)
+
+#######################################################################################
+# Animation
+#######################################################################################
+	
+def WriteAnimationHeader(file, header):
+    with file.Chunk(513):
+        WriteString(file, header.name)
+        WriteString(file, header.hieraName)
+        WriteLong(file, header.numFrames)
+        WriteLong(file, header.frameRate)
+
+# with packQuaternions the quaternions are stored in 48 bits (quantize_w4d.PackQuaternions)
+def WriteTimeCodedAnimationChannel(file, channel, packQuaternions = False):
+    with file.Chunk(514):
+        if channel.vectorLen == 4 and packQuaternions:
+            WriteShort(file, quantize_w4d.SMALLEST_THREE)
+        else:
+            WriteShort(file, channel.vectorLen)
+        WriteShort(file, channel.type)
+        WriteShort(file, channel.pivot)
+
+        if channel.vectorLen == 4 and packQuaternions:
+            keys = np.empty(len(channel.frames), dtype = [("frame", "<u2"), ("value", "<u2", (3,))])
+            keys["frame"] = channel.frames
+            keys["value"] = quantize_w4d.PackQuaternions(channel.values) if len(keys) > 0 else 0
+            WriteArray(file, keys.view(np.uint8))
+        elif channel.vectorLen == 1:
+            for frame, value in zip(channel.frames, channel.values):
+                WriteShort(file, frame)
+                WriteFloat(file, value)
+        elif channel.vectorLen == 4:
+            for frame, quat in zip(channel.frames, channel.values):
+                WriteShort(file, frame)
+                WriteQuaternion(file, quat)
+
+def WriteAnimation(file, animation, packQuaternions = False):
+    print("\n### NEW ANIMATION: ###")
+    buffer = ChunkBuffer()
+    with buffer.Chunk(512, container = True):
+        WriteAnimationHeader(buffer, animation.header)
+        print("Header")
+        for channel in animation.channels:
+            WriteTimeCodedAnimationChannel(buffer, channel, packQuaternions)
+            print("Channel")
+    buffer.WriteTo(file)
+	
+#######################################################################################
+# Model
+#######################################################################################
+
+def WriteModel(file, model):
+    print("\n### NEW MODEL: ###")
+    buffer = ChunkBuffer()
+    with buffer.Chunk(0):
+        print(model.name)
+        WriteString(buffer, model.name)
+        print(model.hieraName)
+        WriteString(buffer, model.hieraName)
+    buffer.WriteTo(file)
+			
+#######################################################################################
+# Box
+#######################################################################################	
+
+def WriteBox(file, box):
+    print("\n### NEW BOX: ###")
+    buffer = ChunkBuffer()
+    with buffer.Chunk(1024):
+        WriteVector(buffer, box.center)
+        WriteVector(buffer, box.extend)
+    buffer.WriteTo(file)
+	
+#######################################################################################
+# Vertices
+#######################################################################################
+
+def WriteMeshVerticesArray(file, vertices):
+    with file.Chunk(3):
+        WriteArray(file, ToArray(vertices, "<f4", 3))
+
+#######################################################################################
+# Normals
+#######################################################################################
+	
+def WriteMeshNormalsArray(file, normals):
+    with file.Chunk(4):
+        WriteArray(file, ToArray(normals, "<f4", 3))
+	
+#######################################################################################
+# Faces
+#######################################################################################	
+
+def WriteMeshFaceArray(file, faces):
+    with file.Chunk(5):
+        WriteArray(file, ToArray(faces, "<u4", 3))
+		
+#######################################################################################
+# uvCoords
+#######################################################################################	
+
+def WriteMeshUVCoords(file, uvCoords):
+    with file.Chunk(6):
+        WriteArray(file, ToArray(uvCoords, "<f4", 2))
+		
+#######################################################################################
+# Compact Vertex Streams
+#######################################################################################
+
+def WriteMeshQuantizedVertices(file, quantized):
+    with file.Chunk(9):
+        WriteArray(file, ToArray(quantized, "<u2", 3))
+
+def WriteMeshOctahedralNormals(file, encoded):
+    with file.Chunk(10):
+        WriteArray(file, ToArray(encoded, "<i2", 2))
+
+def WriteMeshHalfUVCoords(file, encoded):
+    with file.Chunk(11):
+        WriteArray(file, ToArray(encoded, "<f2", 2))
+
+def WriteMeshShortFaces(file, faces):
+    with file.Chunk(12):
+        WriteArray(file, ToArray(faces, "<u2", 3))
+
+# writes each stream of the mesh compact if it stays within the tolerance, else as floats
+def WriteMeshStreams(file, mesh, tolerance):
+    verts = ToArray(mesh.verts, "<f4", 3)
+    header = mesh.header
+    # the positions have to lie inside the box of the header, it is all the reader knows
+    inBox = len(verts) == 0 or (np.all(verts >= np.asarray(header.minCorner, dtype = np.float32))
+        and np.all(verts <= np.asarray(header.maxCorner, dtype = np.float32)))
+    if inBox:
+        quantized = quantize_w4d.QuantizePositions(verts, header.minCorner, header.maxCorner)
+        decoded = quantize_w4d.DequantizePositions(quantized, header.minCorner, header.maxCorner)
+    if inBox and quantize_w4d.MaxError(verts, decoded) <= tolerance.position:
+        WriteMeshQuantizedVertices(file, quantized)
+    else:
+        WriteMeshVerticesArray(file, verts)
+
+    normals = ToArray(mesh.normals, "<f4", 3)
+    encoded = quantize_w4d.EncodeOctahedral(normals)
+    if quantize_w4d.MaxError(normals, quantize_w4d.DecodeOctahedral(encoded)) <= tolerance.normal:
+        WriteMeshOctahedralNormals(file, encoded)
+    else:
+        WriteMeshNormalsArray(file, normals)
+
+    faces = ToArray(mesh.faces, "<u4", 3)
+    if len(verts) <= 0x10000:
+        WriteMeshShortFaces(file, faces)
+    else:
+        WriteMeshFaceArray(file, faces)
+
+    uvCoords = ToArray(mesh.uvCoords, "<f4", 2)
+    encoded = quantize_w4d.EncodeHalf(uvCoords)
+    if quantize_w4d.MaxError(uvCoords, quantize_w4d.DecodeHalf(encoded)) <= tolerance.uv:
+        WriteMeshHalfUVCoords(file, encoded)
+    else:
+        WriteMeshUVCoords(file, uvCoords)
+		
+#######################################################################################
+# VertexInfluences
+#######################################################################################	
+
+def WriteMeshVertexInfluences(file, influences):
+    records = np.empty((len(influences), 2), dtype = "<u2")
+    for i, inf in enumerate(influences):
+        records[i] = (inf.boneIdx, int(round(inf.boneInf * 100)))
+    with file.Chunk(7):
+        WriteArray(file, records)
+
+# the second influence of each vertex, only written if a vertex has one
+def WriteMeshExtraVertexInfluences(file, influences):
+    records = np.empty((len(influences), 2), dtype = "<u2")
+    for i, inf in enumerate(influences):
+        records[i] = (inf.xtraIdx, int(round(inf.xtraInf * 100)))
+    with file.Chunk(8):
+        WriteArray(file, records)
+		
+#######################################################################################
+# Texture
+#######################################################################################	
+	
+def WriteTexture(file, texture):
+    with file.Chunk(31, container = True):
+        WriteString(file, texture.name)
+        WriteUnsignedByte(file, texture.type)
+        WriteFloat(file, texture.value)
+	
+        #write animation chunks
+		
+#######################################################################################
+# Material
+#######################################################################################	
+
+def WriteMeshMaterial(file, material):
+    with file.Chunk(30, container = True):
+        WriteRGBA(file, material.diffuse)
+        WriteFloat(file, material.diffuse_intensity)
+        WriteRGBA(file, material.specular)
+        WriteFloat(file, material.specular_intensity)
+        WriteFloat(file, material.emit)
+        WriteFloat(file, material.alpha)
+ 
+        for texture in material.textures:
+            WriteTexture(file, texture)
+		
+#######################################################################################
+# Mesh
+#######################################################################################	
+
+def WriteMeshHeader(file, header): 
+    with file.Chunk(2):
+        WriteUnsignedByte(file, header.type)
+        WriteString(file, header.meshName)
+        WriteShort(file, header.parentPivot)
+        WriteLong(file, header.faceCount)
+        WriteLong(file, header.vertCount)
+        WriteVector(file, header.minCorner)
+        WriteVector(file, header.maxCorner)
+        WriteVector(file, header.sphCenter)
+        WriteFloat(file, header.sphRadius)
+	
+# with a quantize_w4d.MeshTolerance the vertex streams may be written as the compact chunks 9 - 12
+def WriteMesh(file, mesh, tolerance = None):
+    print("\n### NEW MESH: ###")
+    buffer = ChunkBuffer()
+    with buffer.Chunk(1, container = True):
+        WriteMeshHeader(buffer, mesh.header)
+        print(mesh.header.meshName)
+        #print("Header")
+        if tolerance is not None:
+            WriteMeshStreams(buffer, mesh, tolerance)
+        else:
+            WriteMeshVerticesArray(buffer, mesh.verts)
+            #print("Vertices")
+            WriteMeshNormalsArray(buffer, mesh.normals)
+            #print("Normals")
+            WriteMeshFaceArray(buffer, mesh.faces)
+            #print("Faces")
+            WriteMeshUVCoords(buffer, mesh.uvCoords)
+            #print("uvCoords")
+        if len(mesh.vertInfs) > 0:
+            WriteMeshVertexInfluences(buffer, mesh.vertInfs) 
+            #print("Vertex Influences")
+            if any(inf.xtraInf > 0 for inf in mesh.vertInfs):
+                WriteMeshExtraVertexInfluences(buffer, mesh.vertInfs)
+        for mat in mesh.materials:
+            WriteMeshMaterial(buffer, mat)
+            #print("Material")
+    buffer.WriteTo(file)